@@ -0,0 +1,163 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+Background analysis jobs: an analysis (install, feature extraction, prediction and reproduction of a package)
+is queued and runs on a bounded pool of worker threads, so the HTTP request that submitted it returns at once.
+"""
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+_current = threading.local()
+
+
+def mark_stage(stage: str) -> None:
+    """
+    Marks the start of a stage of the analysis that runs in the current thread (the previous stage ends).
+    Does nothing outside of a job, so the analysis code can call it unconditionally.
+    """
+    job = getattr(_current, 'job', None)
+    if job is not None:
+        job.start_stage(stage)
+
+
+class Job:
+    """
+    An analysis of one package version and its state, with the duration of every stage.
+    """
+
+    def __init__(self, name: str, version: str):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.version = version
+        self.state = QUEUED
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.stages = OrderedDict()  # {stage: [start time, end time]}
+        self.result = None
+        self.status_code = None
+        self.error = None
+        self.finished_event = threading.Event()
+
+    def start_stage(self, stage: str) -> None:
+        now = time.time()
+        self._end_stage(now)
+        self.stages[stage] = [now, None]
+
+    def _end_stage(self, now: float) -> None:
+        if self.stages:
+            last = next(reversed(self.stages.values()))
+            if last[1] is None:
+                last[1] = now
+
+    def to_dict(self) -> dict:
+        def duration(start, end):
+            return round((end if end is not None else time.time()) - start, 3) if start is not None else None
+
+        return {
+            'jobId': self.id,
+            'package_name': self.name,
+            'package_version': self.version,
+            'state': self.state,
+            'submitted': self.submitted,
+            'queuedSeconds': duration(self.submitted, self.started),
+            'runSeconds': duration(self.started, self.finished),
+            'stages': {stage: duration(start, end) for stage, (start, end) in self.stages.items()},
+            'result': self.result,
+            'statusCode': self.status_code,
+            'error': self.error,
+        }
+
+
+class JobQueue:
+    """
+    Runs analysis jobs on a bounded pool of worker threads.
+
+    The runner is called as runner(name, version) in a worker thread and returns (result, status code).
+    A package version that is already queued or running is not submitted again: its job is returned.
+    The most recent max_jobs jobs are kept for the status endpoints.
+    """
+
+    def __init__(self, runner, workers: int = 1, max_jobs: int = 1000):
+        self.runner = runner
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()  # {job id: Job}
+        self.active = {}  # {(name, version): Job} of the queued and running jobs
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='analysis')
+
+    def submit(self, name: str, version: str) -> Job:
+        """
+        Queues the analysis of a package version and returns its job.
+        """
+        with self.lock:
+            job = self.active.get((name, version))
+            if job is not None:
+                return job
+            job = Job(name, version)
+            self.jobs[job.id] = job
+            self.active[(name, version)] = job
+            while len(self.jobs) > self.max_jobs:
+                oldest_id = next(iter(self.jobs))
+                if self.jobs[oldest_id].state in (QUEUED, RUNNING):
+                    break
+                del self.jobs[oldest_id]
+        self.executor.submit(self._run, job)
+        return job
+
+    def _run(self, job: Job) -> None:
+        job.state = RUNNING
+        job.started = time.time()
+        _current.job = job
+        try:
+            job.result, job.status_code = self.runner(job.name, job.version)
+            job.state = DONE if job.status_code is None or job.status_code < 400 else FAILED
+        except Exception as e:
+            logging.exception(f"analysis job {job.id} of {job.name}@{job.version} failed")
+            job.error = str(e)
+            job.state = FAILED
+        finally:
+            _current.job = None
+            job.finished = time.time()
+            job._end_stage(job.finished)
+            with self.lock:
+                self.active.pop((job.name, job.version), None)
+            job.finished_event.set()
+
+    def wait(self, jobs, timeout: float = None) -> bool:
+        """
+        Waits until all the jobs are finished, or until the timeout (seconds) passed.
+        Returns True if all the jobs are finished.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for job in jobs:
+            remaining = max(0, deadline - time.monotonic()) if deadline is not None else None
+            if not job.finished_event.wait(remaining):
+                return False
+        return True
+
+    def get(self, job_id: str):
+        """
+        Returns the job with the id, or None if it's unknown (or was already dropped from the history).
+        """
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self, state: str = None) -> list:
+        """
+        Returns the jobs, the most recent first, optionally only the jobs in the state.
+        """
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return [job for job in reversed(jobs) if state is None or job.state == state]
+
+    def shutdown(self, wait: bool = True) -> None:
+        self.executor.shutdown(wait=wait)
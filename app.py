@@ -1,23 +1,33 @@
+from boot import LazyComponent, warm_up, record, report, BOOT_STARTED
 from flask import Flask, request, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
 import subprocess
 import os
-import numpy as np
-import pandas as pd
 from typing import Literal
-from features_utils import bitwise_operation, general_search, parse_file, extract_package_details, write_dict_to_csv, write_each_package_and_version_to_csv_and_create_dir, calculate_entropy, find_longest_line_in_the_file, search_substring_in_package
+from features_utils import bitwise_operation, general_search, write_dict_to_csv, calculate_entropy, find_longest_line_in_the_file, search_substring_in_package
+from features_utils import PII_KEYWORDS, FILE_SYS_ACCESS_KEYWORDS, PROCESS_CREATION_KEYWORDS, NETWORK_ACCESS_KEYWORDS, CRYPTO_FUNCTIONALITY_KEYWORDS, DATA_ENCODING_KEYWORDS, DYNAMIC_CODE_GENERATION_KEYWORDS, PACKAGE_INSTALLATION_KEYWORDS, extract_code_features_of_files
+from features_utils import get_language, GEOLOCATION_KEYWORDS, is_minified_by_entropy, scan_package_directory, resolve_package_root
+from features_cache import FeatureCache, FEATURE_CACHE_PATH
+from verdict_cache import VerdictCache
+from vote_buffer import VoteBuffer
+from analysis_jobs import JobQueue, mark_stage, DONE, FAILED
+from workspaces import Workspace
+from tarball_analysis import analyse_tarball, fetch_tarball, MAX_TARBALL_SIZE
+from registry_metadata import RegistryClient, PackageNotFound, InvalidVersionRange, repository_url_of, git_head_of, publish_time_of
+from download_stats import DownloadStats
+from hash_index import get_hash_index
+from package_hash import hash_package, file_digests
+from package_store import PackageStore
+from single_flight import SingleFlight, AnalysisLeases
+from inference import Predictor, FEATURE_COLUMNS
+from clone_index import load_clone_index, package_file_set, CLONE_INDEX_PATH
 import logging
-import math
-import joblib
-import hashlib
-import json
-import sys
-import csv
-import random
 import time
-from pymongo import MongoClient
-from bson import json_util
-from datetime import datetime, timedelta
-import requests
+import multiprocessing
+import atexit
+import io
+import json
+import click
 from flask_cors import CORS
 
 
@@ -38,14 +48,89 @@ has_license = 0
 
 # MongoDB connection URI
 MONGO_URI = ""
-NPM_API_URL = 'https://api.npmjs.org/downloads/point'
+# Directory names that are not scanned for the directory features of a package,
+# e.g. PRUNE_NESTED_NODE_MODULES + PRUNE_GIT + PRUNE_TEST_FIXTURES (the model was trained without pruning)
+PACKAGE_SCAN_PRUNE_DIRS = []
+
+# False in the processes started by multiprocessing (the feature extraction workers import the main module as well),
+# where the caches, the threads and the clients of the server are not created
+SERVER_PROCESS = multiprocessing.parent_process() is None
+
+# The persistent cache of the features of files by their contents (disabled when the path is empty)
+feature_cache = FeatureCache(FEATURE_CACHE_PATH) if FEATURE_CACHE_PATH and SERVER_PROCESS else None
+
+# The client of the metadata of packages in the registry (instead of npm view)
+registry_client = RegistryClient() if SERVER_PROCESS else None
+# The weekly download counts of packages
+download_stats = DownloadStats() if SERVER_PROCESS else None
+
+
+def connect_database():
+    from pymongo import MongoClient
+    # Create a MongoClient using the connection URI
+    client = MongoClient(MONGO_URI)
+
+    # Access your MongoDB database
+    return client.get_database("SafeDep")
+
+
+# The MongoDB database, connected on its first use (one client for all the collections)
+mongo_database = LazyComponent('mongo client', connect_database)
+
+
+def connect_packages_collection():
+    return mongo_database.get().get_collection("Packages")
+
+
+# The verdicts of the Packages collection, connected (and its indexes ensured) on its first use
+package_store = LazyComponent('mongo', lambda: PackageStore(connect_packages_collection()))
+
+# The in-process cache of the verdict documents of the Packages collection
+VERDICT_CACHE_MAX_ENTRIES = 10000
+VERDICT_CACHE_TTL = 300  # seconds
+VERDICT_CACHE_NEGATIVE_TTL = 30  # seconds, for packages that are not in the database
+verdict_cache = VerdictCache(
+    VERDICT_CACHE_MAX_ENTRIES, VERDICT_CACHE_TTL, VERDICT_CACHE_NEGATIVE_TTL)
+
+# Votes are buffered and written to the db as increments every VOTE_FLUSH_INTERVAL seconds (0 writes every vote
+# through), or as soon as the votes of VOTE_BUFFER_MAX_PENDING packages are buffered
+VOTE_FLUSH_INTERVAL = float(os.environ.get('SAFEDEP_VOTE_FLUSH_INTERVAL', 1.0))
+VOTE_BUFFER_MAX_PENDING = 1000
+vote_buffer = None
+if SERVER_PROCESS:
+    vote_buffer = VoteBuffer(lambda increments: package_store.get().apply_votes(increments),
+                             VOTE_FLUSH_INTERVAL, VOTE_BUFFER_MAX_PENDING)
+    # the buffered votes are flushed when the server shuts down
+    atexit.register(vote_buffer.close)
+
+# How packages are analysed: 'install' - npm install the package (and its dependencies) and extract the
+# features from node_modules, 'tarball' - stream the published tarball of the package from the registry
+ANALYSIS_MODE = os.environ.get('SAFEDEP_ANALYSIS_MODE', 'install')
+
+# The number of analyses that run in the background at the same time (every analysis has its own workspace).
+# extract_feature keeps the features in the module globals and appends them to dataset-validation.csv, so in the
+# 'install' mode one analysis runs at a time; the files of a package are still parsed in a process pool.
+ANALYSIS_WORKERS = 4 if ANALYSIS_MODE == 'tarball' else 1
+
+# The feed of the hashes of known malicious packages
+MALICIOUS_HASH_CSV = 'malicious_hash.csv'
+
+# The near-duplicate index of known malicious packages (empty when there is no index file), loaded on its first use
+clone_index = LazyComponent('clone index', lambda: load_clone_index(CLONE_INDEX_PATH))
 
-# Create a MongoClient using the connection URI
-client = MongoClient(MONGO_URI)
+# Concurrent analyses of the same package version are coalesced: in the process the first caller runs the analysis
+# and the others wait for its result; with SAFEDEP_ANALYSIS_LEASES=1 also across the workers (processes, hosts) that
+# share the database, through a lease per package version in the AnalysisLeases collection
+analysis_flights = SingleFlight()
+ANALYSIS_LEASES = os.environ.get('SAFEDEP_ANALYSIS_LEASES', '') == '1'
+analysis_leases = LazyComponent('analysis leases', lambda: AnalysisLeases(
+    mongo_database.get().get_collection("AnalysisLeases"))) if ANALYSIS_LEASES else None
 
-# Access your MongoDB database
-db = client.get_database("SafeDep")
-collection = db.get_collection("Packages")
+# The scripts of the reproducer, they run in the workspaces of the analyses
+REPRODUCER_DIR = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), 'utils', 'reproducer')
+# The longest time (seconds) POST /package waits for the analyses of a batch
+BATCH_ANALYSIS_TIMEOUT = 600
 
 
 def search_PII(root_node) -> Literal[1, 0]:
@@ -54,9 +139,7 @@ def search_PII(root_node) -> Literal[1, 0]:
      """
     logging.info("start func: search_PII")
     # print('root node search pii: ',root_node)
-    keywords = ['screenshot', ['keypress', 'POST'],
-                'creditcard', 'cookies', 'passwords', 'appData']
-    return general_search(root_node, keywords)
+    return general_search(root_node, PII_KEYWORDS)
 
 
 def search_file_sys_access(root_node) -> Literal[1, 0]:
@@ -72,12 +155,9 @@ def search_file_sys_access(root_node) -> Literal[1, 0]:
     It provides functions for reading and writing files,
     creating and deleting directories, and more.'''
 
-    keywords = ['read', 'write', 'file',
-                'require("fs")', 'os = require("os")', 'platform', 'hostname', 'system32']
-
     logging.info("start func: search_file_sys_access")
 
-    return general_search(root_node, keywords)
+    return general_search(root_node, FILE_SYS_ACCESS_KEYWORDS)
 
 
 def search_file_process_creation(root_node) -> Literal[1, 0]:
@@ -101,8 +181,7 @@ def search_file_process_creation(root_node) -> Literal[1, 0]:
     run shell commands, and manage the communication between a Node.js process and its child processes.'''
 
     logging.info("start func: search_file_process_creation")
-    keywords = ['exec', 'spawn', 'fork', 'thread', 'process', 'child_process']
-    return general_search(root_node, keywords)
+    return general_search(root_node, PROCESS_CREATION_KEYWORDS)
 
 
 def search_network_access(root_node) -> Literal[1, 0]:
@@ -117,9 +196,7 @@ def search_network_access(root_node) -> Literal[1, 0]:
     but it is very very unlikely that we will transfer data out from the device.
     thus we marked 'send' keyword'''
 
-    keywords = ['send', 'export', 'upload', 'post',
-                'XMLHttpRequest', 'submit', 'dns', 'nodemailer']
-    return general_search(root_node, keywords)
+    return general_search(root_node, NETWORK_ACCESS_KEYWORDS)
 
 
 def search_cryptographic_functionality(root_node) -> Literal[1, 0]:
@@ -131,9 +208,8 @@ def search_cryptographic_functionality(root_node) -> Literal[1, 0]:
 
     '''(3)(a) Cryptographic functionality
     mining: The process of finding a hash that meets certain criteria in a cryptocurrency network.'''
-    keywords = ['crypto', 'mining', 'miner', 'cpu']
 
-    return general_search(root_node, keywords)
+    return general_search(root_node, CRYPTO_FUNCTIONALITY_KEYWORDS)
 
 
 def search_data_encoding(root_node) -> Literal[1, 0]:
@@ -156,10 +232,7 @@ def search_data_encoding(root_node) -> Literal[1, 0]:
     JSON.stringify: This is a built-in method in JavaScript for converting a JavaScript object to a JSON string. 
     JSON is a widely used format for encoding data structures and exchanging data between client and server.'''
 
-    keywords = ['encodeURIComponent', 'querystring', 'qs',
-                'base64', 'btoa', 'atob', 'Buffer', 'JSON.stringify']
-
-    return general_search(root_node, keywords)
+    return general_search(root_node, DATA_ENCODING_KEYWORDS)
 
 
 def search_dynamic_code_generation(root_node) -> Literal[1, 0]:
@@ -174,9 +247,8 @@ def search_dynamic_code_generation(root_node) -> Literal[1, 0]:
     # Function -> Function constructor: This allows you to dynamically create a new function
     and execute it. The Function constructor takes a string of code as its
     argument and returns a reference to a new function that can be executed.'''
-    keywords = ['eval', 'Function']
 
-    return general_search(root_node, keywords)
+    return general_search(root_node, DYNAMIC_CODE_GENERATION_KEYWORDS)
 
 
 def search_package_installation(root_node) -> Literal[1, 0]:
@@ -189,9 +261,8 @@ def search_package_installation(root_node) -> Literal[1, 0]:
     #In npm, pre-install and post-install are scripts that can
     be defined in the scripts section of the package.json file.
     These scripts are executed before and after the installation of packages, respectively.'''
-    keywords = ['preinstall', 'postinstall', 'install', 'sudo']
 
-    return general_search(root_node, keywords)
+    return general_search(root_node, PACKAGE_INSTALLATION_KEYWORDS)
 
 
 def search_minified_code(directory_path) -> Literal[1, 0]:
@@ -231,24 +302,7 @@ def search_minified_code(directory_path) -> Literal[1, 0]:
                 # Append the entropy to the list of entropy values
                 entropy_values.append(entropy)
 
-    is_minified = 0
-
-    # Calculate the average entropy and standard deviation of the entropy values
-    if len(entropy_values) != 0:
-        avg_entropy = sum(entropy_values) / len(entropy_values)
-        std_dev_entropy = math.sqrt(
-            sum((x - avg_entropy)**2 for x in entropy_values) / len(entropy_values))
-
-        # Create a feature indicating whether the data is minified or not
-        AVG_ENTROPY_THRESHOLD = 5
-        STD_DEV_ENTROPY_THRESHOLD = 0.1
-        if avg_entropy > AVG_ENTROPY_THRESHOLD and std_dev_entropy > STD_DEV_ENTROPY_THRESHOLD:
-            is_minified = 1
-        logging.info(f'avg_entropy: {avg_entropy}')
-        logging.info(f'std_dev_entropy: {std_dev_entropy}')
-        logging.info(f'is_minified: {is_minified}')
-
-    return is_minified
+    return is_minified_by_entropy(entropy_values)
 
 
 def search_packages_with_no_content(directory_path: str) -> Literal[1, 0]:
@@ -282,9 +336,7 @@ def search_geolocation(directory_path) -> Literal[1, 0]:
     logging.info("start func: search_location")
 
     # searching for an API that gets the location of the device base on its IP.
-    keywords = ['ipgeolocation']
-
-    return search_substring_in_package(directory_path, keywords)
+    return search_substring_in_package(directory_path, GEOLOCATION_KEYWORDS)
 
 
 def longest_line_in_the_package(directory_path: str) -> int:
@@ -377,6 +429,8 @@ def predict(dataDict):
 
 
 app = Flask(__name__)
+# request bodies (also chunked ones, which have no Content-Length) larger than the largest tarball are refused with a 413
+app.config['MAX_CONTENT_LENGTH'] = MAX_TARBALL_SIZE
 CORS(app)
 
 # target_folder = "./node_modules/normalize-git-url"
@@ -396,12 +450,15 @@ def extract_feature(directory, target_folder, package_name, package_version, lev
 
         if root == target_folder:
 
+            # parse the files of the folder (in parallel for big folders),
+            # the code features of every file are merged into the package below
+            file_paths = [os.path.join(root, file) for file in files
+                          if (file.endswith('.js') or file.endswith('.json')) and not file.endswith('.min.js')]
+            files_code_features = dict(
+                zip(file_paths, extract_code_features_of_files(file_paths, cache=feature_cache)))
+
             # Process the files or perform actions in the target folder
-            for file in files:
-                # print('file: ', file)
-                if (not file.endswith('.js') and not file.endswith('.json')) or file.endswith('.min.js'):
-                    continue
-                file_path = os.path.join(root, file)
+            for file_path in file_paths:
                 # print('file_path: ', file_path)
 
                 if package_name not in package_features:
@@ -411,46 +468,51 @@ def extract_feature(directory, target_folder, package_name, package_version, lev
                     package_features[package_name] = init_lst
 
                 name, version = package_name, package_version
-                is_PII = max(is_PII, search_PII(parse_file(file_path)))
-                is_file_sys_access = max(is_file_sys_access, search_file_sys_access(
-                    parse_file(file_path)))  # 3
-                is_process_creation = max(is_process_creation, search_file_process_creation(
-                    parse_file(file_path)))  # 4
-                is_network_access = max(is_network_access, search_network_access(
-                    parse_file(file_path)))  # 5
-                is_crypto_functionality = max(is_crypto_functionality, search_cryptographic_functionality(
-                    parse_file(file_path)))  # 6
-                is_data_encoding = max(
-                    is_data_encoding, search_data_encoding(parse_file(file_path)))   # 7
-                is_dynamic_code_generation = max(is_dynamic_code_generation, search_dynamic_code_generation(
-                    parse_file(file_path)))   # 8
-                is_package_installation = max(is_package_installation, search_package_installation(
-                    parse_file(file_path)))   # 9
+                # the keywords of features 2-9, searched in a single traversal of the file
+                code_features = files_code_features[file_path]
+                is_PII = max(is_PII, code_features[0])  # 2
+                is_file_sys_access = max(
+                    is_file_sys_access, code_features[1])  # 3
+                is_process_creation = max(
+                    is_process_creation, code_features[2])  # 4
+                is_network_access = max(
+                    is_network_access, code_features[3])  # 5
+                is_crypto_functionality = max(
+                    is_crypto_functionality, code_features[4])  # 6
+                is_data_encoding = max(is_data_encoding, code_features[5])   # 7
+                is_dynamic_code_generation = max(
+                    is_dynamic_code_generation, code_features[6])   # 8
+                is_package_installation = max(
+                    is_package_installation, code_features[7])   # 9
                 # print('etodur')
                 # print('visited packages: ', visited_packages)
                 # check if the package was already processed
                 if package_name not in visited_packages:
                     logging.info(f'package_name: {package_name}')
                     logging.debug(f"{package_name} was not visit yet")
-                    index = root.find(package_name)
-                    # print('index: ', index)
-                    logging.debug(f"dirname[:index]: {root[:index]}")
-                    # print('root[:index]: ', root[:index])
-                    is_geolocation = max(
-                        is_geolocation, search_geolocation(root[:index]))  # 10
-                    is_minified_code = max(
-                        is_minified_code, search_minified_code(root[:index]))  # 11
-                    is_has_no_content = search_packages_with_no_content(
-                        root[:index])  # 12
-                    # print('majhe')
-                    longest_line = longest_line_in_the_package(
-                        root[:index])  # 13
-                    # print('\n\n\nreturned longest_line: ', longest_line, '\n\n\n\n')
-                    num_of_files = num_of_files_in_the_package(
-                        root[:index])  # 14
-                    has_license = does_contain_license(root[:index])  # 15
+                    if level == 0:
+                        # the directory features (10-15) of the package root (the directory of its package.json);
+                        # the workspace is used once, so only the package root is scanned, not its dependencies
+                        package_root = resolve_package_root(
+                            directory, package_name)
+                        logging.debug(f"package_root: {package_root}")
+                        directory_features = scan_package_directory(
+                            package_root, prune_dirs=PACKAGE_SCAN_PRUNE_DIRS, cache=feature_cache)
+                        is_geolocation = max(
+                            is_geolocation, directory_features['geolocation'])  # 10
+                        is_minified_code = max(
+                            is_minified_code, directory_features['minified_code'])  # 11
+                        is_has_no_content = directory_features['no_content']  # 12
+                        longest_line = directory_features['longest_line']  # 13
+                        num_of_files = directory_features['num_of_files']  # 14
+                        has_license = directory_features['has_license']  # 15
+                    # the code features of the files in the sub directories (level 1) are merged once,
+                    # the sub directories share the directory features of level 0
+                    if (dirs.__len__() > 0 and level < 1):
+                        for dir in dirs:
+                            extract_feature(os.path.join(root, dir), os.path.join(
+                                root, dir), package_name, package_version, level+1)
                     visited_packages.add(package_name)
-                    # print('shesh')
                 else:
                     logging.debug(f"package_features: {package_features}")
                     is_geolocation = package_features[package_name][10]
@@ -459,11 +521,6 @@ def extract_feature(directory, target_folder, package_name, package_version, lev
                     longest_line = package_features[package_name][13]
                     num_of_files = package_features[package_name][14]
                     has_license = package_features[package_name][15]
-                if (dirs.__len__() > 0 and level < 1):
-                    # print('dirs calling inside: ', level, root ,dirs)
-                    for dir in dirs:
-                        extract_feature(os.path.join(root, dir), os.path.join(
-                            root, dir), package_name, package_version, level+1)
 
                 label = 'Unknown'  # 16
                 # create a new list of the current package's features
@@ -506,43 +563,29 @@ def extract_feature(directory, target_folder, package_name, package_version, lev
         return package_features
 
 
-fileData = open("./utils/predictor/model.pkl", "rb")
-myModel = joblib.load(fileData)
-fileData.close()
+def load_predictor() -> Predictor:
+    from compiled_model import load_compiled_model, COMPILED_MODEL_PATH
+    if os.path.exists(COMPILED_MODEL_PATH):
+        # the model exported to NumPy arrays (see compiled_model.py), no scikit-learn needed
+        myModel = load_compiled_model(COMPILED_MODEL_PATH)
+    else:
+        import joblib
+        fileData = open("./utils/predictor/model.pkl", "rb")
+        myModel = joblib.load(fileData)
+        fileData.close()
+    return Predictor(myModel)
+
+
+# The model, loaded on its first use
+predictor = LazyComponent('model', load_predictor)
 
 
 def predictPackage(featureDict):
-    df = pd.DataFrame([featureDict])
-    prediction = myModel.predict(df)
+    prediction = predictor.get().predict(featureDict)
     print(prediction)
     return prediction
 
 
-def hash_package(root):
-    """
-    Compute an md5 hash of all files under root, visiting them in deterministic order.
-    `package.json` files are stripped of their `name` and `version` fields.
-    """
-    m = hashlib.md5()
-    for dirpath, dirnames, filenames in os.walk(root):
-        dirnames.sort()
-        for filename in sorted(filenames):
-            path = os.path.join(dirpath, filename)
-            m.update(f"{os.path.relpath(path, root)}\n".encode("utf-8"))
-            if filename == "package.json":
-                pkg = json.load(open(path))
-                pkg["name"] = ""
-                pkg["version"] = ""
-                m.update(json.dumps(pkg, sort_keys=True).encode("utf-8"))
-            else:
-                try:
-                    with open(path, "rb") as f:
-                        m.update(f.read())
-                except:
-                    print(f'ERROR: path {path}')
-    return m.hexdigest()
-
-
 def is_hash_in_csv(root: str, csv_file: str) -> int:
     """
     This function calculates the hash of a package and returns 1 if the hash is in the given CSV file, and 0 otherwise.
@@ -554,13 +597,59 @@ def is_hash_in_csv(root: str, csv_file: str) -> int:
     Returns:
         1 if the hash of the directory is in the CSV file, 0 otherwise.
     """
-    hash = hash_package(root)
-    with open(csv_file, 'r') as csvfile:
-        reader = csv.reader(csvfile)
-        for row in reader:
-            if row[0] == hash:
-                return 1
-    return 0
+    return is_digest_in_csv(hash_package(root), csv_file)
+
+
+def is_digest_in_csv(hash: str, csv_file: str) -> int:
+    """
+    Returns 1 if the hash of a package is in the given CSV file, and 0 otherwise.
+    The file is loaded once into an index, which is reloaded when the file changes.
+    """
+    return 1 if get_hash_index(csv_file).contains(hash) else 0
+
+
+def find_package(pkgName, pkgVersion, cached=True):
+    """
+    Returns the verdict document of a package from the verdict cache, or from the database on a cache miss
+    (the result is cached, also when the package isn't in the database). Returns None if the package isn't found.
+    With cached=False the database is always queried (e.g. for a verdict that another worker just stored).
+    """
+    if cached:
+        found, package = verdict_cache.get(pkgName, pkgVersion)
+        if found:
+            return package
+    package = package_store.get().find(pkgName, pkgVersion)
+    verdict_cache.put(pkgName, pkgVersion, package)
+    return package
+
+
+def find_packages(packages):
+    """
+    Returns the verdict documents of several packages: {(name, version): document}, looked up in the verdict
+    cache and then in the database with a single query. Packages that aren't found are not in the result.
+    """
+    found = {}
+    missing = []
+    for pkgName, pkgVersion in dict.fromkeys(packages):
+        cached, package = verdict_cache.get(pkgName, pkgVersion)
+        if not cached:
+            missing.append((pkgName, pkgVersion))
+        elif package is not None:
+            found[(pkgName, pkgVersion)] = package
+    if missing:
+        found.update(package_store.get().find_many(missing))
+        for pkgName, pkgVersion in missing:
+            verdict_cache.put(pkgName, pkgVersion,
+                              found.get((pkgName, pkgVersion)))
+    return found
+
+
+def verdict_to_json(pkg):
+    """
+    Returns the JSON result of a package that is already in the database.
+    """
+    return {'_id': str(pkg['_id']), 'prediction': str(pkg['prediction']), 'features': str(pkg['features']), 'reproducible': str(pkg['reproducible']), 'cloned': str(pkg['cloned']), 'finalPrediction': str(pkg['finalPrediction']),
+            'totalVotes': pkg['totalVotes'], 'agreedVotes': pkg['agreedVotes']}
 
 
 @app.route('/')
@@ -568,6 +657,19 @@ def hello():
     return "Hello from Siam!"
 
 
+@app.route('/cache/stats', methods=['GET'])
+def cacheStats():
+    stats = {'verdicts': verdict_cache.stats(), 'registry': registry_client.stats(), 'votes': vote_buffer.stats(),
+             'maliciousHashes': get_hash_index(MALICIOUS_HASH_CSV).stats(), 'predictions': predictor.get().stats(),
+             'analyses': analysis_flights.stats()}
+    if analysis_leases is not None and analysis_leases.loaded:
+        stats['analysisLeases'] = analysis_leases.get().stats()
+    if feature_cache is not None:
+        stats['features'] = {'hits': feature_cache.hits,
+                             'misses': feature_cache.misses}
+    return jsonify(stats), 200
+
+
 @app.route('/packages/vote', methods=['POST'])
 def vote():
     # Get the JSON data from the request
@@ -583,21 +685,20 @@ def vote():
     pkgVersion = request.args.get('package_version')
     vote = data['vote']
     # query the database for the package
-    package = collection.find_one({"name": pkgName, "version": pkgVersion})
+    package = find_package(pkgName, pkgVersion)
     # print('package: ', package)
     if package:
         # Package found, return the package details as JSON
         # return jsonify({"package_name": package["name"], "package_version": package["version"], "other_info": package["other_info"]})
-        # update the package info
-        totalVotes = package['totalVotes']
-        agreedVotes = package['agreedVotes']
-        if vote == 'Agree':
-            agreedVotes += 1
-        totalVotes += 1
-
-        # update the package info in db
-        collection.find_one_and_update({"name": pkgName, "version": pkgVersion}, {
-                                       "$set": {"totalVotes": totalVotes, "agreedVotes": agreedVotes}})
+        # count the vote, it's written to the db with the next flush of the vote buffer ($inc)
+        agreed = vote == 'Agree'
+        vote_buffer.add(pkgName, pkgVersion, agreed)
+        increments = {"totalVotes": 1, "agreedVotes": 1 if agreed else 0}
+        updated = verdict_cache.increment(pkgName, pkgVersion, increments)
+        if updated is None:
+            updated = {field: package[field] + value for field, value in increments.items()}
+        totalVotes = updated['totalVotes']
+        agreedVotes = updated['agreedVotes']
         return jsonify({"package_name": package["name"], "package_version": package["version"], "totalVotes": totalVotes, "agreedVotes": agreedVotes}), 200
     else:
         # Package not found
@@ -605,45 +706,21 @@ def vote():
 
 
 def getDownloadCount(package_name):
+    """
+    Returns the weekly download counts of a package in the last year (cached, see download_stats).
+    """
+    return {"package_name": package_name, "download_count": download_stats.weekly_downloads(package_name)}
 
-    yearly_download_count = []
-    # Calculate the start and end dates for the week range
-    end_date = datetime.now()
-    for i in range(0, 52):
-        # print('i: ', i)
-        start_date = end_date - timedelta(days=7)
-
-        # Format dates as strings in the 'YYYY-MM-DD' format
-        start_date_str = start_date.strftime('%Y-%m-%d')
-        end_date_str = end_date.strftime('%Y-%m-%d')
-
-        # Build the URL for the npm download stats API
-        url = f'{NPM_API_URL}/{start_date_str}:{end_date_str}/{package_name}'
 
-        try:
-            # Make a GET request to the npm API
-            # print(url)
-            response = requests.get(url)
-            # print(response)
-
-            if response.status_code == 200:
-                # Parse the JSON response and extract the download count
-                data = response.json()
-                # print('data: ', data)
-                download_count = data['downloads']
-                # print('download count: ', download_count)
-                yearly_download_count.append(
-                    {'downloads': download_count, 'startDate': start_date_str, 'endDate': end_date_str})
-                # return jsonify({"package_name": package_name, "download_count": download_count})
-            else:
-                # API request failed
-                print('error occurred')
-                # return jsonify({"error": "Failed to retrieve download count"}, 500)
-        except Exception as e:
-            print("error", str(e))
-            return jsonify({"error": str(e)}, 500)
-        end_date = start_date
-    return {"package_name": package_name, "download_count": yearly_download_count}
+@app.route('/package/downloads', methods=['GET'])
+def getPackageDownloads():
+    package_name = request.args.get('package_name')
+    if not package_name:
+        return jsonify({"error": "package_name is required"}), 400
+    try:
+        return jsonify(getDownloadCount(package_name)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 
 @app.route('/package', methods=['GET'])
@@ -652,24 +729,21 @@ def getPackageDetails():
     package_name = request.args.get('package_name')
     package_version = request.args.get('package_version')
     try:
-        # Run 'npm view' command and capture the output
-        processed_package_name = package_name + '@' + package_version
-        cmd = ['npm', 'view', processed_package_name, '--json']
-        result = subprocess.run(
-            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-
-        if result.returncode == 0:
-
-            package_info = json.loads(result.stdout)
-
-            if (type(package_info) == list):
-                index = package_info.__len__() - 1
-                package_info = package_info[index]
+        # Get the metadata of the package version from the registry (or its cache)
+        try:
+            package_info = registry_client.view(package_name, package_version)
+        except PackageNotFound:
+            package_info = None
+        except InvalidVersionRange as e:
+            return jsonify({"error": str(e)}), 400
+
+        if package_info is not None:
+            # a dist-tag or a range is looked up and analysed as the version that it resolved to
+            package_version = package_info.get('version', package_version)
             # package_info = result.stdout
             # print('package info: ', package_info)
             # get the package info from database
-            package = collection.find_one(
-                {"name": package_name, "version": package_version})
+            package = find_package(package_name, package_version)
             # print('package: ', package)
             if package:
                 # print(type(package_info))
@@ -685,68 +759,130 @@ def getPackageDetails():
                 # package_info['download_count'] = getDownloadCount(package_name)
 
             else:
-                package = posthelper(package_name, package_version)
-                package_info['prediction'] = package['prediction']
-                package_info['reproducible'] = package['reproducible']
-                package_info['cloned'] = package['cloned']
-                package_info['features'] = package['features']
-                package_info['finalPrediction'] = package['finalPrediction']
-                package_info['totalVotes'] = package['totalVotes']
-                package_info['agreedVotes'] = package['agreedVotes']
-                return package
+                # analyse the package in the background, the client polls the job for the verdict
+                job = analysis_jobs.submit(package_name, package_version)
+                package_info['jobId'] = job.id
+                package_info['state'] = job.state
+                return jsonify(package_info), 202
         else:
-            # Command failed
+            # The registry doesn't have the package version
             return jsonify({"error": "Failed to retrieve package information"}, 500)
     except Exception as e:
         return jsonify({"error": str(e)}, 500)
 
 
+def reproducer_env(pkgName: str, pkgVersion: str) -> dict:
+    """
+    Returns the environment of the reproducer scripts: the metadata that they would otherwise look up with npm view
+    (SAFEDEP_REPOSITORY_URL, SAFEDEP_GIT_HEAD, SAFEDEP_PUBLISH_TIME), from the registry client.
+    The scripts fall back to npm view for the values that are missing.
+    """
+    # normalize-git-url is resolved from the server's node_modules when the workspace has none
+    env = dict(os.environ, NODE_PATH=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'node_modules'))
+    try:
+        info = registry_client.view(pkgName, pkgVersion)
+        metadata = {'SAFEDEP_REPOSITORY_URL': repository_url_of(info),
+                    'SAFEDEP_GIT_HEAD': git_head_of(info),
+                    'SAFEDEP_PUBLISH_TIME': publish_time_of(info)}
+    except Exception as e:
+        logging.warning(f"failed to get the metadata of {pkgName}@{pkgVersion}: {e}")
+        return env
+    env.update({key: value for key, value in metadata.items() if value})
+    return env
+
+
+def install_package(pkgName, pkgVersion, workspace):
+    """
+    Installs a package version (and its dependencies) into the node_modules of a workspace.
+    """
+    # Call the build-package.sh script using subprocess
+    cmd = [os.path.join(REPRODUCER_DIR, 'build-package.sh'),
+           pkgName, pkgVersion, workspace.root, workspace.node_modules]
+    # print(cmd)
+    result = subprocess.Popen(cmd, env=reproducer_env(pkgName, pkgVersion))
+    result.wait()
+
+
 def posthelper(pkgName, pkgVersion):
+    """
+    Returns the JSON verdict of a package version and its status code, analysing the package if it isn't in the
+    database. Concurrent calls for the same package version share one analysis and its result.
+    """
+    result, status = analysis_flights.do(f'{pkgName}@{pkgVersion}', lambda: analyse_package(pkgName, pkgVersion))
+    return jsonify(result), status
+
+
+def analyse_package(pkgName, pkgVersion):
+    """
+    Returns the verdict of a package version (as a JSON-serialisable dict) and its status code: the stored verdict,
+    or the verdict of a new analysis of the package.
+    """
+    workspace = None
+    lease = None
     try:
         global is_PII, is_file_sys_access, is_process_creation, is_network_access, is_crypto_functionality, is_data_encoding, is_dynamic_code_generation, is_package_installation, is_geolocation, is_minified_code, is_has_no_content, longest_line, num_of_files, has_license
         # check if a package with the same name and version already exists in the database
-        pkg = collection.find_one({"name": pkgName, "version": pkgVersion})
+        pkg = find_package(pkgName, pkgVersion)
 
         if pkg:
             # Package found, return the package details as JSON
             # print('package found: ', pkg)
             # return jsonify(pkg_serializable), 200
-            return jsonify({'_id': str(pkg['_id']), 'prediction': str(pkg['prediction']), 'features': str(pkg['features']), 'reproducible': str(pkg['reproducible']), 'cloned': str(pkg['cloned']), 'finalPrediction': str(pkg['finalPrediction']),
-                            'totalVotes': pkg['totalVotes'], 'agreedVotes': pkg['agreedVotes']}), 200
-
-         # Call the reproduce-package.sh script using subprocess
-        cmd = ['./utils/reproducer/build-package.sh',
-               pkgName, pkgVersion, '.', 'node_modules']
-        # print(cmd)
-        result = subprocess.Popen(cmd)
-        result.wait()
-        # print(cmd)
-        # print(result.returncode)
-        # print(result.stdout)
-        # print(result.stderr)
-        is_crypto_functionality = 0
-        is_data_encoding = 0
-        is_dynamic_code_generation = 0
-        is_package_installation = 0
-        is_geolocation = 0
-        is_minified_code = 0
-        is_has_no_content = 0
-        longest_line = 0
-        num_of_files = 0
-        has_license = 0
-        is_PII = 0
-        is_file_sys_access = 0
-        is_process_creation = 0
-        is_network_access = 0
-        pkgFeatures = extract_feature(
-            './node_modules', './node_modules/'+pkgName, pkgName, pkgVersion, 0)[pkgName]
-        # traverse the node_modules folder and find the folder of pkgName
-        # print('pkgFeatures: ', pkgFeatures)
-        # remove the first two elements from the list
-        pkgFeatures = pkgFeatures[2:]
-        # remove the last element from the list
-        pkgFeatures = pkgFeatures[:-1]
+            return verdict_to_json(pkg), 200
+
+        if analysis_leases is not None:
+            # analyse the package unless another worker is analysing it, then wait for its verdict
+            lease, pkg = analysis_leases.get().acquire_or_wait(
+                f'{pkgName}@{pkgVersion}', lambda: find_package(pkgName, pkgVersion, cached=False))
+            if pkg:
+                return verdict_to_json(pkg), 200
+
+        # analyse the package in its own workspace
+        workspace = Workspace(pkgName, pkgVersion)
+        packageHash = None
+        packageFiles = None
+        if ANALYSIS_MODE == 'tarball':
+            # analyse the published tarball of the package, without installing it
+            mark_stage('download')
+            tarball = fetch_tarball(pkgName, pkgVersion)
+            mark_stage('extract')
+            analysis = analyse_tarball(io.BytesIO(tarball), cache=feature_cache)
+            pkgFeatures = analysis.features
+            packageHash = analysis.hash
+            packageFiles = analysis.file_digests
+        else:
+            mark_stage('install')
+            install_package(pkgName, pkgVersion, workspace)
+            # print(cmd)
+            # print(result.returncode)
+            # print(result.stdout)
+            # print(result.stderr)
+            mark_stage('extract')
+            is_crypto_functionality = 0
+            is_data_encoding = 0
+            is_dynamic_code_generation = 0
+            is_package_installation = 0
+            is_geolocation = 0
+            is_minified_code = 0
+            is_has_no_content = 0
+            longest_line = 0
+            num_of_files = 0
+            has_license = 0
+            is_PII = 0
+            is_file_sys_access = 0
+            is_process_creation = 0
+            is_network_access = 0
+            pkgFeatures = extract_feature(
+                workspace.node_modules, workspace.package_dir(pkgName), pkgName, pkgVersion, 0)[pkgName]
+            # traverse the node_modules folder and find the folder of pkgName
+            # print('pkgFeatures: ', pkgFeatures)
+            # remove the first two elements from the list
+            pkgFeatures = pkgFeatures[2:]
+            # remove the last element from the list
+            pkgFeatures = pkgFeatures[:-1]
         print('pkgFeatures: ', pkgFeatures)
+        mark_stage('predict')
         prediction = predictPackage(pkgFeatures)
         # print('prediction: ', prediction)
         reproducible = 0
@@ -755,10 +891,16 @@ def posthelper(pkgName, pkgVersion):
         # print('finalPrediction: ', finalPrediction)
         if prediction[0] == 'Malicious' or prediction[0] == 'malicious':
             # check reproducibility
-            cmd = ['./utils/reproducer/reproduce-package.sh',
-                   pkgName + '@' + pkgVersion, './node_modules/']
+            if ANALYSIS_MODE == 'tarball':
+                # the reproducer compares the installed package, which the tarball analysis didn't install
+                mark_stage('install')
+                install_package(pkgName, pkgVersion, workspace)
+            mark_stage('reproduce')
+            cmd = [os.path.join(REPRODUCER_DIR, 'reproduce-package.sh'),
+                   pkgName + '@' + pkgVersion, workspace.node_modules + '/']
             result = subprocess.run(cmd, stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE, text=True)
+                                    stderr=subprocess.PIPE, text=True, cwd=workspace.root,
+                                    env=reproducer_env(pkgName, pkgVersion))
             # print(result.returncode)
             # print(result.stdout)
             # print(result.stderr)
@@ -768,13 +910,21 @@ def posthelper(pkgName, pkgVersion):
                 reproducible = 1
 
         else:
-            cloned = is_hash_in_csv('./node_modules/'+pkgName,
-                                    'malicious_hash.csv')
+            mark_stage('clone')
+            if packageHash is None:
+                packageHash = hash_package(workspace.package_dir(pkgName))
+            cloned = is_digest_in_csv(packageHash, MALICIOUS_HASH_CSV)
+            if cloned == 0 and len(clone_index.get()) > 0:
+                # check near-duplicates of known malicious packages
+                if packageFiles is None:
+                    packageFiles = file_digests(workspace.package_dir(pkgName))
+                clones = clone_index.get().query(package_file_set(packageFiles))
+                if clones:
+                    logging.info(f"{pkgName}@{pkgVersion} is a clone of {clones}")
+                    cloned = 1
             if cloned == 1:
                 # pkgFeatures.append('malicious')
                 finalPrediction = 'Malicious'
-                cloned = 0
-                # check clone
 
             # insert the package info in db
         packageInfo = {
@@ -789,156 +939,270 @@ def posthelper(pkgName, pkgVersion):
             'agreedVotes': 0,
         }
         # Store the data in the MongoDB collection
-        collection.insert_one(packageInfo)
+        mark_stage('store')
+        stored = package_store.get().save_verdict(packageInfo)
+        verdict_cache.put(pkgName, pkgVersion, stored)
 
-        return jsonify({'prediction': str(prediction[0]), 'features': str(pkgFeatures), 'reproducible': str(reproducible), 'cloned': str(cloned), 'finalPrediction': str(finalPrediction), 'totalVotes': str(0), 'agreedVotes': str(0)}), 200
+        return {'prediction': str(prediction[0]), 'features': str(pkgFeatures), 'reproducible': str(reproducible), 'cloned': str(cloned), 'finalPrediction': str(finalPrediction), 'totalVotes': str(stored['totalVotes']), 'agreedVotes': str(stored['agreedVotes'])}, 200
+    except Exception as e:
+        return {'error': str(e)}, 500
+    finally:
+        if workspace is not None:
+            workspace.cleanup()
+        if lease is not None:
+            lease.release()
 
-        # Return the received JSON object as a JSON response
 
-        # create a package.json file in ./reproducer
-        # run npm install in ./reproducer
+def parse_package_spec(package):
+    """
+    Returns the (name, version) of a "name:version" string, or None if it isn't one.
+    """
+    if not isinstance(package, str):
+        return None
+    parts = package.split(':')
+    if len(parts) != 2 or not parts[0] or not parts[1]:
+        return None
+    return parts[0], parts[1]
+
+
+def run_analysis_job(pkgName, pkgVersion):
+    """
+    Runs the analysis of a package in a background job: returns the JSON result of posthelper and its status code.
+    """
+    with app.app_context():
+        response, status = posthelper(pkgName, pkgVersion)
+        return response.get_json(), status
+
+
+analysis_jobs = JobQueue(run_analysis_job, ANALYSIS_WORKERS)
+
+
+@app.route('/jobs', methods=['POST'])
+def submitJobs():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('packages'), list):
+        return jsonify({'error': 'Invalid JSON data'}), 400
+    requested = [parse_package_spec(package) for package in data['packages']]
+    invalid = [package for package, spec in zip(data['packages'], requested) if spec is None]
+    if invalid:
+        return jsonify({'error': 'Invalid package, expected "name:version"', 'packages': invalid}), 400
+    jobs = [analysis_jobs.submit(pkgName, pkgVersion).to_dict() for pkgName, pkgVersion in requested]
+    return jsonify({'jobs': jobs}), 202
+
+
+@app.route('/jobs', methods=['GET'])
+def listJobs():
+    state = request.args.get('state')
+    return jsonify({'jobs': [job.to_dict() for job in analysis_jobs.list(state)]}), 200
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def getJob(job_id):
+    job = analysis_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict()), 200
+
+
+@app.route('/predict', methods=['POST'])
+def predictBatch():
+    """
+    Scores a batch of feature vectors in one call of the model: {"features": [[...14 features...] or {column: value}]}
+    -> {"predictions": [...]}, in the order of FEATURE_COLUMNS.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        predictions = predictor.get().predict_batch(data.get('features') or [])
+    except (ValueError, TypeError, KeyError) as e:
+        return jsonify({'error': str(e), 'columns': FEATURE_COLUMNS}), 400
+    return jsonify({'predictions': [str(prediction) for prediction in predictions]}), 200
 
-        return jsonify(data), 200
+
+@app.cli.command('rescore')
+@click.option('--batch-size', default=1000, show_default=True, help='The number of packages scored per call.')
+def rescorePackages(batch_size):
+    """
+    Re-scores the stored features of the analysed packages with the current model, in batches, and prints the
+    packages whose prediction changed (one JSON object per line). The stored verdicts are not modified.
+    Run offline, e.g. after a model update: flask --app app rescore
+    """
+    scored = 0
+    changed = 0
+    for batch in package_store.get().iter_features(batch_size):
+        batch = [pkg for pkg in batch if len(pkg.get('features') or []) == len(FEATURE_COLUMNS)]
+        if not batch:
+            continue
+        predictions = predictor.get().predict_batch([pkg['features'] for pkg in batch])
+        scored += len(batch)
+        for pkg, prediction in zip(batch, predictions):
+            if str(prediction) != str(pkg.get('prediction')):
+                changed += 1
+                click.echo(json.dumps({'name': pkg['name'], 'version': pkg['version'],
+                                       'storedPrediction': pkg.get('prediction'), 'prediction': str(prediction)}))
+    click.echo(f"scored {scored} packages, {changed} changed", err=True)
+
+
+@app.cli.command('ingest')
+@click.argument('verdicts_file', type=click.File('r'))
+@click.option('--batch-size', default=1000, show_default=True, help='The number of verdicts written per bulk write.')
+def ingestVerdicts(verdicts_file, batch_size):
+    """
+    Stores the verdicts of a JSON lines file (one {"name", "version", "features", "prediction", "reproducible",
+    "cloned", "finalPrediction"} object per line, e.g. of an offline analysis run) in the Packages collection, with
+    bulk upserts of batch_size verdicts. The votes of packages that are already stored are kept.
+    Run offline: flask --app app ingest verdicts.jsonl
+    """
+    stored = 0
+    batch = []
+    for line_number, line in enumerate(verdicts_file, 1):
+        if not line.strip():
+            continue
+        try:
+            verdict = json.loads(line)
+        except ValueError as e:
+            raise click.ClickException(f"line {line_number}: {e}")
+        if not isinstance(verdict, dict) or not verdict.get('name') or not verdict.get('version'):
+            raise click.ClickException(f"line {line_number}: a verdict needs a name and a version")
+        batch.append(verdict)
+        if len(batch) == batch_size:
+            stored += package_store.get().save_verdicts(batch)
+            batch = []
+    if batch:
+        stored += package_store.get().save_verdicts(batch)
+    click.echo(f"stored {stored} verdicts", err=True)
+
+
+@app.route('/hashes/check', methods=['POST'])
+def checkHashes():
+    """
+    Checks many package hashes against the feed of malicious hashes: {"hashes": [...]} -> {"results": {hash: 0 or 1}}.
+    """
+    data = request.get_json(silent=True) or {}
+    hashes = data.get('hashes')
+    if not isinstance(hashes, list) or not all(isinstance(value, str) for value in hashes):
+        return jsonify({'error': 'hashes must be a list of strings'}), 400
+    results = get_hash_index(MALICIOUS_HASH_CSV).contains_many(hashes)
+    return jsonify({'results': {value: int(found) for value, found in results.items()}}), 200
+
+
+def read_upload(stream, max_size: int) -> io.BytesIO:
+    """
+    Reads the body of a request into memory, up to max_size bytes: a larger body raises RequestEntityTooLarge as soon
+    as max_size bytes were read, whether the request has a Content-Length or not (chunked).
+    """
+    data = io.BytesIO()
+    while True:
+        chunk = stream.read(1024 * 1024)
+        if not chunk:
+            break
+        data.write(chunk)
+        if data.tell() > max_size:
+            raise RequestEntityTooLarge()
+    data.seek(0)
+    return data
+
+
+@app.route('/tarball', methods=['POST'])
+def postTarball():
+    """
+    Analyses an uploaded package tarball (the 'tarball' file of a multipart form, or the body of the request),
+    for clients that can't reach the registry. The verdict isn't stored, since the contents of an upload
+    aren't necessarily the published package.
+    """
+    try:
+        if request.content_length is not None and request.content_length > MAX_TARBALL_SIZE:
+            return jsonify({'error': 'The tarball is too large'}), 413
+        upload = request.files.get('tarball')
+        tarball = upload.stream if upload is not None else read_upload(request.stream, MAX_TARBALL_SIZE)
+        analysis = analyse_tarball(tarball, cache=feature_cache)
+        prediction = predictPackage(analysis.features)
+        finalPrediction = prediction[0]
+        cloned = is_digest_in_csv(analysis.hash, MALICIOUS_HASH_CSV)
+        if cloned == 0 and clone_index.get().query(package_file_set(analysis.file_digests)):
+            cloned = 1
+        if cloned == 1:
+            finalPrediction = 'Malicious'
+        return jsonify({'package_name': analysis.name, 'package_version': analysis.version, 'hash': analysis.hash,
+                        'prediction': str(prediction[0]), 'features': str(analysis.features), 'cloned': str(cloned),
+                        'finalPrediction': str(finalPrediction)}), 200
+    except RequestEntityTooLarge:
+        return jsonify({'error': 'The tarball is too large'}), 413
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/package', methods=['POST'])
 def post():
+    """
+    Analyses a batch of packages ("name:version" strings in data['packages']) and returns the result of every
+    package: {"results": {"name:version": result}}. Verdicts that are already known are looked up in one query,
+    the other packages are analysed concurrently in the background jobs. A failure is reported in the result of
+    its package, and packages that are still analysed after BATCH_ANALYSIS_TIMEOUT are returned with their job.
+    """
     try:
-        global is_PII, is_file_sys_access, is_process_creation, is_network_access, is_crypto_functionality, is_data_encoding, is_dynamic_code_generation, is_package_installation, is_geolocation, is_minified_code, is_has_no_content, longest_line, num_of_files, has_license
-
         data = request.get_json()
 
         if data is None:
             return jsonify({'error': 'Invalid JSON data'}), 400
         packages = data['packages']
+
+        results = {}
+        requested = {}  # {package: (name, version)}, without duplicates
         for package in packages:
-            # print(package)
-            # num = random.randint(0, 10)
-            # if num < 5:
-            #     # SLEEP FOR 2 seconds
-            #     # time.sleep(2)
-            #     packageInfo = {
-            #         'prediction': 'Benign',
-            #         'features': [0, 1, 1, 0, 0, 0, 0, 0, 0],
-            #         'reproducible': 0,
-            #         'cloned': 0,
-            #         'finalPrediction': 'Benign'
-            #     }
-            #     # Store the data in the MongoDB collection
-            #     collection.insert_one(packageInfo)
-
-            # else:
-            #     packageInfo = {
-            #         'prediction': 'Benign',
-            #         'features': [0, 1, 1, 0, 0, 0, 0, 0, 0]
-            #     }
-            #     # Store the data in the MongoDB collection
-            #     collection.insert_one(packageInfo)
-            # return jsonify({'prediction': 'Malicious', 'features': [
-            #         1, 0, 0, 1, 1, 1, 1, 1, 1]}), 200
-            pkgName = package.split(':')[0]
-            pkgVersion = package.split(':')[1]
-            # print('pkgName: ', pkgName, 'pkgVersion: ', pkgVersion)
-            responnse = posthelper(pkgName, pkgVersion)
-
-            # check if a package with the same name and version already exists in the database
-            # pkg = collection.find_one({"name": pkgName, "version": pkgVersion})
-            # print('package: ', pkg)
-            # if pkg:
-            #     # Package found, return the package details as JSON
-            #     print('package found: ', pkg)
-            #     # return jsonify(pkg_serializable), 200
-            #     return jsonify({'_id': str(pkg['_id']), 'prediction': str(pkg['prediction']), 'features': str(pkg['features']), 'reproducible': str(pkg['reproducible']), 'cloned': str(pkg['cloned']), 'finalPrediction': str(pkg['finalPrediction'])}), 200
-
-            # # Call the reproduce-package.sh script using subprocess
-            # cmd = ['./utils/reproducer/build-package.sh',
-            #        pkgName, pkgVersion, '.', 'node_modules']
-            # print(cmd)
-            # result = subprocess.Popen(cmd)
-            # result.wait()
-            # # print(cmd)
-            # # print(result.returncode)
-            # # print(result.stdout)
-            # # print(result.stderr)
-            # is_crypto_functionality = 0
-            # is_data_encoding = 0
-            # is_dynamic_code_generation = 0
-            # is_package_installation = 0
-            # is_geolocation = 0
-            # is_minified_code = 0
-            # is_has_no_content = 0
-            # longest_line = 0
-            # num_of_files = 0
-            # has_license = 0
-            # is_PII = 0
-            # is_file_sys_access = 0
-            # is_process_creation = 0
-            # is_network_access = 0
-            # pkgFeatures = extract_feature(
-            #     './node_modules', './node_modules/'+pkgName, pkgName, pkgVersion, 0)[pkgName]
-            # # traverse the node_modules folder and find the folder of pkgName
-            # print('pkgFeatures: ', pkgFeatures)
-            # # remove the first two elements from the list
-            # pkgFeatures = pkgFeatures[2:]
-            # # remove the last element from the list
-            # pkgFeatures = pkgFeatures[:-1]
-            # prediction = predictPackage(pkgFeatures)
-            # print('prediction: ', prediction)
-            # reproducible = 0
-            # cloned = 0
-            # finalPrediction = prediction[0]
-            # if prediction[0] == 'Malicious' or prediction[0] == 'malicious':
-            #     # check reproducibility
-            #     cmd = ['./utils/reproducer/reproduce-package.sh',
-            #            pkgName + '@' + pkgVersion, './node_modules/']
-            #     result = subprocess.run(cmd, stdout=subprocess.PIPE,
-            #                             stderr=subprocess.PIPE, text=True)
-            #     print(result.returncode)
-            #     print(result.stdout)
-            #     print(result.stderr)
-            #     if result.returncode == 0:
-            #         pkgFeatures.append('benign')
-            #         finalPrediction = 'Benign'
-            #         reproducible = 1
-
-            # else:
-            #     cloned = is_hash_in_csv('./node_modules/'+pkgName,
-            #                             'malicious_hash.csv')
-            #     if cloned == 1:
-            #         pkgFeatures.append('malicious')
-            #         finalPrediction = 'Malicious'
-            #         cloned = 0
-            #     # check clone
-
-            # # insert the package info in db
-            # packageInfo = {
-            #     'name': pkgName,
-            #     'version': pkgVersion,
-            #     'features': pkgFeatures,
-            #     'prediction': prediction[0],
-            #     'reproducible': reproducible,
-            #     'cloned': cloned,
-            #     'finalPrediction': finalPrediction,
-            #     'totalVotes': 0,
-            #     'agreedVotes': 0,
-            # }
-            # # Store the data in the MongoDB collection
-            # collection.insert_one(packageInfo)
-
-            # return jsonify({'prediction': str(prediction[0]), 'features': str(pkgFeatures), 'reproducible': str(reproducible), 'cloned': str(cloned), 'finalPrediction': str(finalPrediction)}), 200
-
-        # Return the received JSON object as a JSON response
-
-        # create a package.json file in ./reproducer
-        # run npm install in ./reproducer
-
-        return responnse
+            spec = parse_package_spec(package)
+            if spec is None:
+                results[str(package)] = {'error': 'Invalid package, expected "name:version"'}
+                continue
+            requested[package] = spec
+
+        known = find_packages(list(requested.values()))
+        jobs = {}
+        for package, (pkgName, pkgVersion) in requested.items():
+            pkg = known.get((pkgName, pkgVersion))
+            if pkg:
+                results[package] = verdict_to_json(pkg)
+            else:
+                jobs[package] = analysis_jobs.submit(pkgName, pkgVersion)
+
+        analysis_jobs.wait(jobs.values(), BATCH_ANALYSIS_TIMEOUT)
+        for package, job in jobs.items():
+            if job.state == DONE:
+                results[package] = job.result
+            elif job.state == FAILED:
+                results[package] = {'error': job.error or (job.result or {}).get('error', 'Analysis failed'),
+                                    'jobId': job.id}
+            else:
+                results[package] = {'jobId': job.id, 'state': job.state}
+
+        return jsonify({'results': results}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+# The components that are initialised on their first use, or by the warm-up
+LAZY_COMPONENTS = [LazyComponent('grammar', get_language), predictor, clone_index, package_store]
+if analysis_leases is not None:
+    LAZY_COMPONENTS.append(analysis_leases)
+# The warm-up of the components when the app is imported: 'background', 'sync' (before serving) or 'off'
+WARM_UP = os.environ.get('SAFEDEP_WARM_UP', 'background')
+
+
+@app.route('/boot', methods=['GET'])
+def bootReport():
+    """
+    Returns the durations of the import of the app and of the initialisation of its components.
+    """
+    stats = report()
+    stats['components'] = {component.name: component.loaded for component in LAZY_COMPONENTS}
+    return jsonify(stats), 200
+
+
+record('import', time.perf_counter() - BOOT_STARTED)
+# the app is imported again in the feature extraction workers (started by a fork server), which use none of it
+if WARM_UP != 'off' and SERVER_PROCESS:
+    warm_up(LAZY_COMPONENTS, background=WARM_UP != 'sync')
+
+
 if __name__ == '__main__':
     # print('db', db)
     app.run(host='0.0.0.0', port=5001)
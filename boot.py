@@ -0,0 +1,94 @@
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+"""
+The boot sequence of the server: importing the app only loads prebuilt artifacts, the heavy components (the grammar,
+the model, the clone index, the MongoDB client) are initialised on their first use or by a warm-up in the background,
+and the time of every step is recorded for GET /boot.
+
+Build the tree-sitter grammar library (at build time, not when the server starts):
+    python boot.py build-grammar
+"""
+
+# When this module was first imported, i.e. the start of the import of the app
+BOOT_STARTED = time.perf_counter()
+
+_timings = OrderedDict()  # {step: seconds}
+_timings_lock = threading.Lock()
+
+
+def record(step: str, seconds: float) -> None:
+    """
+    Records the duration of a boot step.
+    """
+    with _timings_lock:
+        _timings[step] = round(seconds, 4)
+    logging.info(f"boot: {step} took {seconds:.3f}s")
+
+
+def report() -> dict:
+    """
+    Returns the durations of the boot steps and the time since the boot started.
+    """
+    with _timings_lock:
+        steps = dict(_timings)
+    return {'steps': steps, 'secondsSinceBoot': round(time.perf_counter() - BOOT_STARTED, 3)}
+
+
+class LazyComponent:
+    """
+    A component that is initialised by its factory on the first get() (once, even if several threads ask at once),
+    and the time of its initialisation recorded as a boot step.
+    """
+
+    def __init__(self, name: str, factory):
+        self.name = name
+        self.factory = factory
+        self.value = None
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def get(self):
+        if not self.loaded:
+            with self.lock:
+                if not self.loaded:
+                    started = time.perf_counter()
+                    self.value = self.factory()
+                    self.loaded = True
+                    record(self.name, time.perf_counter() - started)
+        return self.value
+
+
+def warm_up(components, background: bool = True):
+    """
+    Initialises the components now, in a background thread (the default) or in the calling thread.
+    A component that fails is logged and left to be initialised on its first use.
+    """
+    def run():
+        started = time.perf_counter()
+        for component in components:
+            try:
+                component.get()
+            except Exception:
+                logging.exception(f"boot: warm-up of {component.name} failed")
+        record('warm-up', time.perf_counter() - started)
+
+    if not background:
+        run()
+        return None
+    thread = threading.Thread(target=run, name='warm-up', daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['build-grammar']:
+        print(f"usage: {sys.argv[0]} build-grammar")
+        sys.exit(1)
+    from features_utils import GRAMMAR_LIBRARY, build_grammar
+    started = time.perf_counter()
+    built = build_grammar()
+    print(f"{GRAMMAR_LIBRARY} {'built' if built else 'is up to date'} ({time.perf_counter() - started:.1f}s)")
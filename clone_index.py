@@ -0,0 +1,141 @@
+import json
+import logging
+import os
+import sys
+import threading
+from collections import Counter
+
+from package_hash import file_digests, file_digests_of_entries
+from tarball_analysis import iter_tarball_files
+
+"""
+A near-duplicate index of known malicious packages: every package is the set of the digests of its files, and the
+index maps every file digest to the known packages that have the file, so the known packages that share files with a
+package are found by looking up its files instead of comparing it with every known package. A package is a clone of
+a known package when it contains at least CLONE_THRESHOLD of the files of the known package (containment), so
+copying a malicious package and adding files to it doesn't hide the copy.
+
+Build an index from malicious packages (directories or tarballs):
+    python clone_index.py malicious_clones.json ./malicious/pkg-a ./malicious/pkg-b-1.0.0.tgz ...
+"""
+
+# The file of the index that the server loads
+CLONE_INDEX_PATH = os.environ.get('SAFEDEP_CLONE_INDEX', 'malicious_clones.json')
+# The minimal fraction of the files of a known malicious package that a package must contain to be its clone
+CLONE_THRESHOLD = float(os.environ.get('SAFEDEP_CLONE_THRESHOLD', 0.8))
+
+
+def package_file_set(digests) -> frozenset:
+    """
+    Returns the file set of a package from its file digests ({relative path: digest}), without unreadable files.
+    """
+    return frozenset(digest for digest in digests.values() if digest)
+
+
+class CloneIndex:
+    """
+    The index of the file sets of known malicious packages: {file digest: ids of the known packages with the file}.
+    """
+
+    def __init__(self, threshold: float = CLONE_THRESHOLD):
+        self.threshold = threshold
+        self.packages = {}  # {package id: file set}
+        self.files = {}  # {file digest: set of package ids}
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.packages)
+
+    def add(self, package_id: str, files: frozenset) -> None:
+        """
+        Adds a known malicious package by its file set (replacing the files of a package with the same id).
+        """
+        with self.lock:
+            for digest in self.packages.get(package_id, ()):
+                self.files[digest].discard(package_id)
+            self.packages[package_id] = files
+            for digest in files:
+                self.files.setdefault(digest, set()).add(package_id)
+
+    def query(self, files: frozenset, threshold: float = None) -> list:
+        """
+        Returns the known malicious packages that share at least `threshold` of their files with the file set
+        (the containment of the known package in it: |files & known| / |known|): [(package id, containment)],
+        the most contained first. Only the known packages that share a file with the file set are looked at.
+        """
+        threshold = self.threshold if threshold is None else threshold
+        shared = Counter()
+        with self.lock:
+            for digest in files:
+                shared.update(self.files.get(digest, ()))
+            sizes = {package_id: len(self.packages[package_id]) for package_id in shared}
+        matches = [(package_id, count / sizes[package_id]) for package_id, count in shared.items()
+                   if count / sizes[package_id] >= threshold]
+        return sorted(matches, key=lambda match: match[1], reverse=True)
+
+    def save(self, path: str) -> None:
+        with self.lock:
+            packages = {package_id: sorted(files) for package_id, files in self.packages.items()}
+        with open(path, 'w') as f:
+            json.dump({'packages': packages}, f)
+
+    @classmethod
+    def load(cls, path: str, threshold: float = CLONE_THRESHOLD) -> 'CloneIndex':
+        index = cls(threshold)
+        with open(path, 'r') as f:
+            packages = json.load(f)['packages']
+        for package_id, files in packages.items():
+            index.add(package_id, frozenset(files))
+        return index
+
+
+def load_clone_index(path: str = CLONE_INDEX_PATH) -> CloneIndex:
+    """
+    Loads the index of the file, or returns an empty index if there is none.
+    """
+    if not os.path.exists(path):
+        logging.info(f"no clone index at {path}, near-duplicate clone detection is disabled")
+        return CloneIndex()
+    index = CloneIndex.load(path)
+    logging.info(f"loaded {len(index)} packages into the clone index from {path}")
+    return index
+
+
+def _package_files(path: str):
+    """
+    Returns (package id, file set) of a package directory or tarball, where the id is name@version from its
+    package.json (or the name of the path).
+    """
+    if os.path.isdir(path):
+        digests = file_digests(path)
+        package_json = os.path.join(path, 'package.json')
+        try:
+            with open(package_json, 'r') as f:
+                pkg = json.load(f)
+        except (OSError, ValueError):
+            pkg = {}
+    else:
+        digests = {}
+        pkg = {}
+        with open(path, 'rb') as f:
+            for relpath, data in iter_tarball_files(f):
+                digests.update(file_digests_of_entries([(relpath, data)]))
+                if relpath == 'package.json':
+                    pkg = json.loads(data)
+    if pkg.get('name') and pkg.get('version'):
+        package_id = f"{pkg['name']}@{pkg['version']}"
+    else:
+        package_id = os.path.basename(os.path.normpath(path))
+    return package_id, package_file_set(digests)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(f"usage: {sys.argv[0]} <index.json> <package directory or tarball>...")
+        sys.exit(1)
+    index = CloneIndex.load(sys.argv[1]) if os.path.exists(sys.argv[1]) else CloneIndex()
+    for package_path in sys.argv[2:]:
+        package_id, files = _package_files(package_path)
+        index.add(package_id, files)
+        print(f"{package_id}: {len(files)} files")
+    index.save(sys.argv[1])
@@ -0,0 +1,157 @@
+import csv
+import sys
+
+import numpy as np
+
+"""
+A NumPy-only evaluator of the package classifier: the hard-voting VotingClassifier of utils/predictor/model.pkl
+(a DecisionTreeClassifier, a GaussianNB and an RBF SVC) exported to flat arrays, so predicting needs neither
+scikit-learn nor its per-call input validation.
+
+Export the model (needs scikit-learn) and check that the exported model predicts like the pickled one:
+    python compiled_model.py export utils/predictor/model.pkl utils/predictor/model.npz
+    python compiled_model.py check utils/predictor/model.pkl utils/predictor/model.npz utils/predictor/dataset-train.csv
+"""
+
+# The exported model that the server loads (the pickled model is used if it's missing)
+COMPILED_MODEL_PATH = './utils/predictor/model.npz'
+# The datasets that the exported model is checked on after the export
+PARITY_DATASETS = ['./utils/predictor/dataset-train.csv', './utils/predictor/dataset-validationSrc.csv']
+
+
+def export_model(model) -> dict:
+    """
+    Returns the arrays of a fitted VotingClassifier(voting='hard') of a DecisionTreeClassifier, a GaussianNB and an
+    SVC(kernel='rbf') over two classes, in the order of its estimators.
+    """
+    if model.voting != 'hard':
+        raise ValueError(f"only hard voting is supported, not {model.voting}")
+    if len(model.le_.classes_) != 2:
+        raise ValueError("only binary classifiers are supported")
+    tree, nb, svc = model.estimators_
+    if svc.kernel != 'rbf':
+        raise ValueError(f"only the rbf kernel is supported, not {svc.kernel}")
+    weights = model.weights if model.weights is not None else [1] * len(model.estimators_)
+    return {
+        'classes': np.asarray(model.le_.classes_).astype(str),
+        'feature_names': np.asarray(getattr(model, 'feature_names_in_', [])).astype(str),
+        'weights': np.asarray(weights, dtype=np.float64),
+        # the node table of the tree: leaves have children_left == -1
+        'tree_children_left': tree.tree_.children_left.astype(np.int64),
+        'tree_children_right': tree.tree_.children_right.astype(np.int64),
+        'tree_feature': tree.tree_.feature.astype(np.int64),
+        'tree_threshold': tree.tree_.threshold.astype(np.float64),
+        'tree_leaf_class': np.asarray(tree.classes_)[tree.tree_.value[:, 0, :].argmax(axis=1)].astype(np.int64),
+        # the class means, variances and priors of the naive Bayes
+        'nb_log_prior': np.log(nb.class_prior_).astype(np.float64),
+        'nb_theta': nb.theta_.astype(np.float64),
+        'nb_var': nb.var_.astype(np.float64),
+        'nb_classes': np.asarray(nb.classes_).astype(np.int64),
+        # the support vectors and dual coefficients of the SVM (decision = dual_coef . K(sv, x) + intercept)
+        'svc_support_vectors': svc.support_vectors_.astype(np.float64),
+        'svc_dual_coef': svc.dual_coef_[0].astype(np.float64),
+        'svc_intercept': np.float64(svc.intercept_[0]),
+        'svc_gamma': np.float64(svc._gamma),
+        'svc_classes': np.asarray(svc.classes_).astype(np.int64),
+    }
+
+
+class CompiledModel:
+    """
+    Evaluates an exported model: predict(X) returns the class names of the rows of X, like the VotingClassifier.
+    """
+
+    def __init__(self, arrays):
+        for name, value in arrays.items():
+            setattr(self, name, np.asarray(value))
+        self.classes = self.classes.astype(object)
+        if len(self.feature_names):
+            self.feature_names_in_ = self.feature_names.astype(object)
+        self.nb_log_norm = -0.5 * np.log(2.0 * np.pi * self.nb_var).sum(axis=1)
+        self.svc_sv_square = (self.svc_support_vectors ** 2).sum(axis=1)
+
+    def tree_predict(self, X: np.ndarray) -> np.ndarray:
+        # the tree compares the features in float32, like DecisionTreeClassifier
+        X32 = X.astype(np.float32)
+        rows = np.arange(len(X))
+        node = np.zeros(len(X), dtype=np.int64)
+        inner = self.tree_children_left[node] != -1
+        while inner.any():
+            current = node[inner]
+            go_left = X32[rows[inner], self.tree_feature[current]] <= self.tree_threshold[current]
+            node[inner] = np.where(go_left, self.tree_children_left[current], self.tree_children_right[current])
+            inner = self.tree_children_left[node] != -1
+        return self.tree_leaf_class[node]
+
+    def nb_predict(self, X: np.ndarray) -> np.ndarray:
+        # the joint log likelihood of every class, like GaussianNB
+        jll = np.stack([self.nb_log_prior[i] + (self.nb_log_norm[i]
+                                                - 0.5 * (((X - self.nb_theta[i]) ** 2) / self.nb_var[i]).sum(axis=1))
+                        for i in range(len(self.nb_classes))], axis=1)
+        return self.nb_classes[jll.argmax(axis=1)]
+
+    def svc_predict(self, X: np.ndarray) -> np.ndarray:
+        # the rbf kernel as libsvm computes it: exp(-gamma * (x.x + sv.sv - 2 x.sv))
+        distances = (X ** 2).sum(axis=1)[:, None] + self.svc_sv_square[None, :] - 2.0 * X @ self.svc_support_vectors.T
+        decision = np.exp(-self.svc_gamma * distances) @ self.svc_dual_coef + self.svc_intercept
+        return self.svc_classes[(decision >= 0).astype(np.int64)]
+
+    def predict(self, X) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float64)
+        votes = np.stack([self.tree_predict(X), self.nb_predict(X), self.svc_predict(X)], axis=1)
+        # the class with the most (weighted) votes, the first class on a tie - like np.argmax(np.bincount(...))
+        counts = np.stack([((votes == c) * self.weights).sum(axis=1) for c in range(len(self.classes))], axis=1)
+        return self.classes[counts.argmax(axis=1)]
+
+
+def save_compiled_model(arrays: dict, path: str) -> None:
+    with open(path, 'wb') as f:
+        np.savez(f, **arrays)
+
+
+def load_compiled_model(path: str = COMPILED_MODEL_PATH) -> CompiledModel:
+    with np.load(path, allow_pickle=False) as arrays:
+        return CompiledModel({name: arrays[name] for name in arrays.files})
+
+
+def read_dataset(csv_file: str) -> np.ndarray:
+    """
+    Returns the feature matrix of a dataset CSV (without its package, version and label columns).
+    """
+    with open(csv_file, 'r') as f:
+        reader = csv.DictReader(f)
+        columns = [column for column in reader.fieldnames if column not in ('package', 'version', 'label')]
+        return np.array([[float(row[column]) for column in columns] for row in reader], dtype=np.float64)
+
+
+def check_parity(model, compiled: CompiledModel, X: np.ndarray) -> int:
+    """
+    Returns the number of rows of X that the compiled model predicts differently than the scikit-learn model.
+    """
+    return int((np.asarray(model.predict(X)) != compiled.predict(X)).sum())
+
+
+if __name__ == '__main__':
+    import warnings
+    import joblib
+
+    if len(sys.argv) < 4 or sys.argv[1] not in ('export', 'check'):
+        print(f"usage: {sys.argv[0]} export <model.pkl> <model.npz>\n"
+              f"       {sys.argv[0]} check <model.pkl> <model.npz> <dataset.csv>...")
+        sys.exit(1)
+    warnings.filterwarnings('ignore', message='X does not have valid feature names')
+    with open(sys.argv[2], 'rb') as f:
+        model = joblib.load(f)
+    if sys.argv[1] == 'export':
+        save_compiled_model(export_model(model), sys.argv[3])
+        datasets = PARITY_DATASETS
+    else:
+        datasets = sys.argv[4:]
+    compiled = load_compiled_model(sys.argv[3])
+    failed = False
+    for dataset in datasets:
+        X = read_dataset(dataset)
+        mismatches = check_parity(model, compiled, X)
+        print(f"{dataset}: {mismatches} of {len(X)} predictions differ")
+        failed = failed or mismatches > 0
+    sys.exit(1 if failed else 0)
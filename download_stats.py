@@ -0,0 +1,133 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+from requests.adapters import HTTPAdapter
+
+"""
+The weekly download counts of npm packages over the last year, from the npm download stats API.
+The whole year is fetched with one range query (daily counts) and split into weeks locally; if the range query fails,
+the weeks are fetched with point queries, concurrently over a pooled session. A client error of the range query (e.g.
+404 for a package that doesn't exist) is not retried with point queries.
+"""
+
+# The npm download stats API
+NPM_DOWNLOADS_API_URL = os.environ.get('SAFEDEP_NPM_DOWNLOADS_API', 'https://api.npmjs.org/downloads')
+# The number of weeks of download counts
+DOWNLOAD_WEEKS = 52
+# How long the download counts of a package are cached (seconds)
+DOWNLOAD_STATS_TTL = 3600
+# How long the download counts of a package that doesn't exist, or that some weeks are missing of, are cached (seconds)
+DOWNLOAD_STATS_NEGATIVE_TTL = 60
+# The maximal number of packages whose download counts are cached
+DOWNLOAD_STATS_MAX_ENTRIES = 1000
+# The number of concurrent point queries of the fallback
+DOWNLOAD_FETCH_WORKERS = 8
+
+
+def week_ranges(end_date: datetime, weeks: int = DOWNLOAD_WEEKS) -> list:
+    """
+    Returns the (start date, end date) strings ('YYYY-MM-DD') of the weeks that end at end_date, the most recent first.
+    Like the point queries of the API, both dates are inclusive, so consecutive weeks share their boundary day.
+    """
+    ranges = []
+    for i in range(weeks):
+        start_date = end_date - timedelta(days=7)
+        ranges.append((start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
+        end_date = start_date
+    return ranges
+
+
+class DownloadStats:
+    """
+    Fetches and caches the weekly download counts of packages.
+    """
+
+    def __init__(self, api_url: str = NPM_DOWNLOADS_API_URL, ttl: float = DOWNLOAD_STATS_TTL,
+                 max_entries: int = DOWNLOAD_STATS_MAX_ENTRIES, workers: int = DOWNLOAD_FETCH_WORKERS,
+                 negative_ttl: float = DOWNLOAD_STATS_NEGATIVE_TTL):
+        self.api_url = api_url.rstrip('/')
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.workers = workers
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.entries = OrderedDict()  # {package name: (expiry time, weekly download counts)}
+        self.lock = threading.Lock()
+
+    def weekly_downloads(self, package_name: str) -> list:
+        """
+        Returns the download counts of the package in the last DOWNLOAD_WEEKS weeks, the most recent week first:
+        [{'downloads': count, 'startDate': 'YYYY-MM-DD', 'endDate': 'YYYY-MM-DD'}, ...].
+        A package that the API doesn't know has no counts ([]); the weeks whose point queries failed are left out.
+        Raises requests.HTTPError if the API rejects the query (other client errors than 404).
+        """
+        with self.lock:
+            entry = self.entries.get(package_name)
+            if entry is not None and entry[0] >= time.monotonic():
+                self.entries.move_to_end(package_name)
+                return entry[1]
+
+        weeks = week_ranges(datetime.now())
+        ttl = self.ttl
+        try:
+            counts = self._from_range(package_name, weeks)
+        except Exception as e:
+            status = e.response.status_code if isinstance(e, requests.HTTPError) and e.response is not None else None
+            if status == 404:
+                counts = []
+            elif status is not None and 400 <= status < 500:
+                raise
+            else:
+                logging.warning(f"the range query of the downloads of {package_name} failed, using point queries: {e}")
+                counts = self._from_points(package_name, weeks)
+        if len(counts) < len(weeks):
+            # an unknown package, or failed weeks, are retried soon
+            ttl = self.negative_ttl
+
+        with self.lock:
+            self.entries[package_name] = (time.monotonic() + ttl, counts)
+            self.entries.move_to_end(package_name)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return counts
+
+    def _from_range(self, package_name: str, weeks: list) -> list:
+        """
+        Fetches the daily counts of the whole span with one range query and sums them per week.
+        """
+        first_day, last_day = weeks[-1][0], weeks[0][1]
+        response = self.session.get(f'{self.api_url}/range/{first_day}:{last_day}/{package_name}', timeout=30)
+        response.raise_for_status()
+        daily = {day['day']: day['downloads'] for day in response.json()['downloads']}
+        # the dates are 'YYYY-MM-DD' strings, so they compare in date order
+        return [{'downloads': sum(count for day, count in daily.items() if start <= day <= end),
+                 'startDate': start, 'endDate': end}
+                for start, end in weeks]
+
+    def _from_points(self, package_name: str, weeks: list) -> list:
+        """
+        Fetches every week with a point query, concurrently. The weeks whose query fails are left out.
+        """
+        def fetch(week):
+            start, end = week
+            try:
+                response = self.session.get(f'{self.api_url}/point/{start}:{end}/{package_name}', timeout=30)
+                if response.status_code == 200:
+                    return {'downloads': response.json()['downloads'], 'startDate': start, 'endDate': end}
+                logging.warning(f"the downloads of {package_name} in {start}:{end} failed: {response.status_code}")
+            except requests.RequestException as e:
+                logging.warning(f"the downloads of {package_name} in {start}:{end} failed: {e}")
+            return None
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            counts = list(executor.map(fetch, weeks))
+        return [count for count in counts if count is not None]
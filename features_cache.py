@@ -0,0 +1,173 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+"""
+A persistent cache of the features of single files, shared by all the packages and requests.
+The files are identified by the hash of their contents, so a file that is installed by many packages
+(lodash, tslib, core-js, ...) is parsed only once as long as the detectors don't change.
+"""
+
+# The path of the SQLite database of the cache, and the maximum number of files kept in each of its tables
+FEATURE_CACHE_PATH = os.environ.get('SAFEDEP_FEATURE_CACHE', 'feature-cache.sqlite3')
+FEATURE_CACHE_MAX_ENTRIES = int(os.environ.get('SAFEDEP_FEATURE_CACHE_MAX_ENTRIES', 1000000))
+
+# last_used is only updated when it's older than this (seconds), so cache hits are mostly read-only
+LAST_USED_RESOLUTION = 3600
+# SQLite limits the number of parameters of a query
+QUERY_BATCH_SIZE = 500
+
+# Bump when the detection logic changes in a way that is not visible in the keywords
+DETECTOR_VERSION = '1'
+
+
+def content_hash(data: bytes) -> str:
+    """
+    Returns the hash of the contents of a file, the key of the file in the cache.
+    """
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def detector_version(keywords_lists) -> str:
+    """
+    Returns the version of the code detectors: cached code features are valid only for the same keywords and
+    DETECTOR_VERSION.
+    """
+    definition = json.dumps([DETECTOR_VERSION, keywords_lists])
+    return hashlib.sha1(definition.encode('utf-8')).hexdigest()
+
+
+class FeatureCache:
+    """
+    A content-addressed cache of the code features (2-9) and the byte statistics (entropy and longest line) of files,
+    stored in a local SQLite database. Every table is bounded to max_entries rows, the least recently used rows are
+    evicted first.
+    """
+
+    # the number of writes between checks of the size of the tables
+    EVICTION_INTERVAL = 1000
+
+    def __init__(self, path: str = FEATURE_CACHE_PATH, max_entries: int = FEATURE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.writes = {}  # {table: writes since the last size check}
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            # a crash can lose the last transactions but not corrupt the database, which is enough for a cache
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS code_features (
+                content_hash TEXT NOT NULL, detector_version TEXT NOT NULL, features TEXT NOT NULL,
+                last_used REAL NOT NULL, PRIMARY KEY (content_hash, detector_version))''')
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS byte_statistics (
+                content_hash TEXT PRIMARY KEY, entropy REAL NOT NULL, longest_line INTEGER NOT NULL,
+                last_used REAL NOT NULL)''')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS code_features_last_used ON code_features (last_used)')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS byte_statistics_last_used ON byte_statistics (last_used)')
+
+    def get_code_features(self, hashes, version: str) -> dict:
+        """
+        Returns {content hash: code features} of the hashes that are in the cache for the detector version.
+        """
+        hashes = list(dict.fromkeys(hashes))
+        found = {}
+        now = time.time()
+        with self.lock, self.connection:
+            for i in range(0, len(hashes), QUERY_BATCH_SIZE):
+                batch = hashes[i:i + QUERY_BATCH_SIZE]
+                placeholders = ','.join('?' * len(batch))
+                rows = self.connection.execute(
+                    f'SELECT content_hash, features, last_used FROM code_features '
+                    f'WHERE detector_version = ? AND content_hash IN ({placeholders})', [version] + batch)
+                stale = []
+                for file_hash, features, last_used in rows:
+                    found[file_hash] = json.loads(features)
+                    if last_used < now - LAST_USED_RESOLUTION:
+                        stale.append((now, file_hash, version))
+                if stale:
+                    self.connection.executemany(
+                        'UPDATE code_features SET last_used = ? WHERE content_hash = ? AND detector_version = ?', stale)
+        self.hits += len(found)
+        self.misses += len(hashes) - len(found)
+        return found
+
+    def put_code_features(self, features_by_hash: dict, version: str) -> None:
+        """
+        Stores the code features of files: {content hash: code features}.
+        """
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO code_features VALUES (?, ?, ?, ?)',
+                [(file_hash, version, json.dumps(features), now) for file_hash, features in features_by_hash.items()])
+        self._written('code_features', len(features_by_hash))
+
+    def get_byte_statistics(self, hashes) -> dict:
+        """
+        Returns {content hash: (entropy, longest line)} of the hashes that are in the cache.
+        """
+        hashes = list(dict.fromkeys(hashes))
+        found = {}
+        now = time.time()
+        with self.lock, self.connection:
+            for i in range(0, len(hashes), QUERY_BATCH_SIZE):
+                batch = hashes[i:i + QUERY_BATCH_SIZE]
+                placeholders = ','.join('?' * len(batch))
+                rows = self.connection.execute(
+                    f'SELECT content_hash, entropy, longest_line, last_used FROM byte_statistics '
+                    f'WHERE content_hash IN ({placeholders})', batch)
+                stale = []
+                for file_hash, entropy, longest_line, last_used in rows:
+                    found[file_hash] = (entropy, longest_line)
+                    if last_used < now - LAST_USED_RESOLUTION:
+                        stale.append((now, file_hash))
+                if stale:
+                    self.connection.executemany(
+                        'UPDATE byte_statistics SET last_used = ? WHERE content_hash = ?', stale)
+        self.hits += len(found)
+        self.misses += len(hashes) - len(found)
+        return found
+
+    def put_byte_statistics(self, statistics_by_hash: dict) -> None:
+        """
+        Stores the byte statistics of files: {content hash: (entropy, longest line)}.
+        """
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO byte_statistics VALUES (?, ?, ?, ?)',
+                [(file_hash, entropy, longest_line, now)
+                 for file_hash, (entropy, longest_line) in statistics_by_hash.items()])
+        self._written('byte_statistics', len(statistics_by_hash))
+
+    def _written(self, table: str, count: int) -> None:
+        self.writes[table] = self.writes.get(table, 0) + count
+        if self.writes[table] >= self.EVICTION_INTERVAL:
+            self.writes[table] = 0
+            self.evict(table)
+
+    def evict(self, table: str) -> None:
+        """
+        Deletes the least recently used rows of a table until it's 90% of max_entries.
+        """
+        with self.lock, self.connection:
+            size = self.connection.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+            if size <= self.max_entries:
+                return
+            excess = size - int(self.max_entries * 0.9)
+            logging.info(f"feature cache: evicting {excess} rows of {table}")
+            self.connection.execute(
+                f'DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} ORDER BY last_used LIMIT ?)', (excess,))
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
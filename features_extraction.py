@@ -1,8 +1,9 @@
 
 from typing import Literal
-from features_utils import bitwise_operation, general_search, parse_file, extract_package_details, write_dict_to_csv, write_each_package_and_version_to_csv_and_create_dir, calculate_entropy, find_longest_line_in_the_file, search_substring_in_package
+from features_utils import bitwise_operation, general_search, extract_package_details, write_dict_to_csv, write_each_package_and_version_to_csv_and_create_dir, calculate_entropy, find_longest_line_in_the_file, search_substring_in_package
+from features_utils import PII_KEYWORDS, FILE_SYS_ACCESS_KEYWORDS, PROCESS_CREATION_KEYWORDS, NETWORK_ACCESS_KEYWORDS, CRYPTO_FUNCTIONALITY_KEYWORDS, DATA_ENCODING_KEYWORDS, DYNAMIC_CODE_GENERATION_KEYWORDS, PACKAGE_INSTALLATION_KEYWORDS, extract_code_features
+from features_utils import GEOLOCATION_KEYWORDS, is_minified_by_entropy, scan_package_directory
 import logging
-import math
 import os
 
 LOGֹ_FORMAT = "%(levelname)s, time: %(asctime)s , line: %(lineno)d- %(message)s "
@@ -19,9 +20,7 @@ def search_PII(root_node) -> Literal[1, 0]:
      """
     logging.info("start func: search_PII")
 
-    keywords = ['screenshot', ['keypress', 'POST'],
-                'creditcard', 'cookies', 'passwords', 'appData']
-    return general_search(root_node, keywords)
+    return general_search(root_node, PII_KEYWORDS)
 
 
 def search_file_sys_access(root_node) -> Literal[1, 0]:
@@ -37,12 +36,9 @@ def search_file_sys_access(root_node) -> Literal[1, 0]:
     It provides functions for reading and writing files,
     creating and deleting directories, and more.'''
 
-    keywords = ['read', 'write', 'file',
-                'require("fs")', 'os = require("os")', 'platform', 'hostname', 'system32']
-
     logging.info("start func: search_file_sys_access")
 
-    return general_search(root_node, keywords)
+    return general_search(root_node, FILE_SYS_ACCESS_KEYWORDS)
 
 
 def search_file_process_creation(root_node) -> Literal[1, 0]:
@@ -66,8 +62,7 @@ def search_file_process_creation(root_node) -> Literal[1, 0]:
     run shell commands, and manage the communication between a Node.js process and its child processes.'''
 
     logging.info("start func: search_file_process_creation")
-    keywords = ['exec', 'spawn', 'fork', 'thread', 'process', 'child_process']
-    return general_search(root_node, keywords)
+    return general_search(root_node, PROCESS_CREATION_KEYWORDS)
 
 
 def search_network_access(root_node) -> Literal[1, 0]:
@@ -82,9 +77,7 @@ def search_network_access(root_node) -> Literal[1, 0]:
     but it is very very unlikely that we will transfer data out from the device.
     thus we marked 'send' keyword'''
 
-    keywords = ['send', 'export', 'upload', 'post',
-                'XMLHttpRequest', 'submit', 'dns', 'nodemailer']
-    return general_search(root_node, keywords)
+    return general_search(root_node, NETWORK_ACCESS_KEYWORDS)
 
 
 def search_cryptographic_functionality(root_node) -> Literal[1, 0]:
@@ -96,9 +89,8 @@ def search_cryptographic_functionality(root_node) -> Literal[1, 0]:
 
     '''(3)(a) Cryptographic functionality
     mining: The process of finding a hash that meets certain criteria in a cryptocurrency network.'''
-    keywords = ['crypto', 'mining', 'miner', 'cpu']
 
-    return general_search(root_node, keywords)
+    return general_search(root_node, CRYPTO_FUNCTIONALITY_KEYWORDS)
 
 
 def search_data_encoding(root_node) -> Literal[1, 0]:
@@ -121,10 +113,7 @@ def search_data_encoding(root_node) -> Literal[1, 0]:
     JSON.stringify: This is a built-in method in JavaScript for converting a JavaScript object to a JSON string. 
     JSON is a widely used format for encoding data structures and exchanging data between client and server.'''
 
-    keywords = ['encodeURIComponent', 'querystring', 'qs',
-                'base64', 'btoa', 'atob', 'Buffer', 'JSON.stringify']
-
-    return general_search(root_node, keywords)
+    return general_search(root_node, DATA_ENCODING_KEYWORDS)
 
 
 def search_dynamic_code_generation(root_node) -> Literal[1, 0]:
@@ -139,9 +128,8 @@ def search_dynamic_code_generation(root_node) -> Literal[1, 0]:
     # Function -> Function constructor: This allows you to dynamically create a new function
     and execute it. The Function constructor takes a string of code as its
     argument and returns a reference to a new function that can be executed.'''
-    keywords = ['eval', 'Function']
 
-    return general_search(root_node, keywords)
+    return general_search(root_node, DYNAMIC_CODE_GENERATION_KEYWORDS)
 
 
 def search_package_installation(root_node) -> Literal[1, 0]:
@@ -154,9 +142,8 @@ def search_package_installation(root_node) -> Literal[1, 0]:
     #In npm, pre-install and post-install are scripts that can
     be defined in the scripts section of the package.json file.
     These scripts are executed before and after the installation of packages, respectively.'''
-    keywords = ['preinstall', 'postinstall', 'install', 'sudo']
 
-    return general_search(root_node, keywords)
+    return general_search(root_node, PACKAGE_INSTALLATION_KEYWORDS)
 
 
 def search_minified_code(directory_path) -> Literal[1, 0]:
@@ -196,24 +183,7 @@ def search_minified_code(directory_path) -> Literal[1, 0]:
                 # Append the entropy to the list of entropy values
                 entropy_values.append(entropy)
 
-    is_minified = 0
-
-    # Calculate the average entropy and standard deviation of the entropy values
-    if len(entropy_values) != 0:
-        avg_entropy = sum(entropy_values) / len(entropy_values)
-        std_dev_entropy = math.sqrt(
-            sum((x - avg_entropy)**2 for x in entropy_values) / len(entropy_values))
-
-        # Create a feature indicating whether the data is minified or not
-        AVG_ENTROPY_THRESHOLD = 5
-        STD_DEV_ENTROPY_THRESHOLD = 0.1
-        if avg_entropy > AVG_ENTROPY_THRESHOLD and std_dev_entropy > STD_DEV_ENTROPY_THRESHOLD:
-            is_minified = 1
-        logging.info(f'avg_entropy: {avg_entropy}')
-        logging.info(f'std_dev_entropy: {std_dev_entropy}')
-        logging.info(f'is_minified: {is_minified}')
-
-    return is_minified
+    return is_minified_by_entropy(entropy_values)
 
 
 def search_packages_with_no_content(directory_path: str) -> Literal[1, 0]:
@@ -247,9 +217,7 @@ def search_geolocation(directory_path) -> Literal[1, 0]:
     logging.info("start func: search_location")
 
     # searching for an API that gets the location of the device base on its IP.
-    keywords = ['ipgeolocation']
-
-    return search_substring_in_package(directory_path, keywords)
+    return search_substring_in_package(directory_path, GEOLOCATION_KEYWORDS)
 
 
 def longest_line_in_the_package(directory_path: str) -> int:
@@ -376,20 +344,10 @@ def extract_features(root_dir: str, malicious: bool) -> None:
                 package_features[package_name] = init_lst
 
             name, version = extract_package_details(package_name)  # 0, 1
-            is_PII = search_PII(parse_file(file_path))  # 2
-            is_file_sys_access = search_file_sys_access(
-                parse_file(file_path))  # 3
-            is_process_creation = search_file_process_creation(
-                parse_file(file_path))  # 4
-            is_network_access = search_network_access(
-                parse_file(file_path))  # 5
-            is_crypto_functionality = search_cryptographic_functionality(
-                parse_file(file_path))  # 6
-            is_data_encoding = search_data_encoding(parse_file(file_path))  # 7
-            is_dynamic_code_generation = search_dynamic_code_generation(
-                parse_file(file_path))  # 8
-            is_package_installation = search_package_installation(
-                parse_file(file_path))  # 9
+            # parse the file once and search the keywords of features 2-9 in a single traversal
+            (is_PII, is_file_sys_access, is_process_creation, is_network_access,  # 2-5
+             is_crypto_functionality, is_data_encoding, is_dynamic_code_generation,  # 6-8
+             is_package_installation) = extract_code_features(file_path)  # 9
             # check if the package was already processed
             if package_name not in visited_packages:
                 print('not in packages')
@@ -397,16 +355,14 @@ def extract_features(root_dir: str, malicious: bool) -> None:
                 logging.debug(f"{package_name} was not visit yet")
                 index = dirname.find("/package")
                 logging.debug(f"dirname[:index]: {dirname[:index]}")
-                is_geolocation = search_geolocation(dirname[:index])  # 10
-                is_minified_code = search_minified_code(dirname[:index])  # 11
-                is_has_no_content = search_packages_with_no_content(
-                    dirname[:index])  # 12
-                longest_line = longest_line_in_the_package(
-                    dirname[:index])  # 13
-                # print('\n\n\nreturned longest_line: ', longest_line, '\n\n\n\n')
-                num_of_files = num_of_files_in_the_package(
-                    dirname[:index])  # 14
-                has_license = does_contain_license(dirname[:index])  # 15
+                # scan the package directory once for all the directory features (10-15)
+                directory_features = scan_package_directory(dirname[:index])
+                is_geolocation = directory_features['geolocation']  # 10
+                is_minified_code = directory_features['minified_code']  # 11
+                is_has_no_content = directory_features['no_content']  # 12
+                longest_line = directory_features['longest_line']  # 13
+                num_of_files = directory_features['num_of_files']  # 14
+                has_license = directory_features['has_license']  # 15
                 visited_packages.add(package_name)
             else:
                 logging.debug(f"package_features: {package_features}")
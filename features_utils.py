@@ -5,30 +5,79 @@ import csv
 import datetime
 import os
 import math
+import re
+import fnmatch
+import json
+import mmap
+import functools
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from features_cache import content_hash, detector_version
 
 """
 TODO:
 * current situation: supports only JS
 * what to improve: have to add a support to TS as well
 """
-# Use the Language.build_library method to compile these into a library that's usable from Python. 
-# This function will return immediately if the library has already been compiled since the last time its source code was modified
-Language.build_library(
-  # Store the library in the `build` directory
-  'build/my-languages.so',
+# The prebuilt library of the tree-sitter grammars, and the grammars that it's built from (by build_grammar)
+GRAMMAR_LIBRARY = os.environ.get('SAFEDEP_GRAMMAR_LIBRARY', 'build/my-languages.so')
+GRAMMAR_SOURCES = ['vendor/tree-sitter-javascript']
 
-  # Include one or more languages
-  [
-    'vendor/tree-sitter-javascript'
-  ]
-)
+def build_grammar() -> bool:
+    """
+    Compiles the grammars into GRAMMAR_LIBRARY with Language.build_library, which does nothing if the library is newer
+    than the sources of the grammars. Run it at build time (python boot.py build-grammar), not when the server starts.
+    Returns True if the library was (re)built.
+    """
+    return Language.build_library(GRAMMAR_LIBRARY, GRAMMAR_SOURCES)
 
-# Load the languages into your app as Language objects:
-JS_LANGUAGE = Language('build/my-languages.so', 'javascript')
+_js_language = None
+_parsers = threading.local()
 
-# reate a Parser and configure it to use one of the languages:
-parser = Parser()
-parser.set_language(JS_LANGUAGE)
+def get_language() -> Language:
+    """
+    Returns the JavaScript language of tree-sitter, loaded from the prebuilt GRAMMAR_LIBRARY on the first call.
+    """
+    global _js_language
+    if _js_language is None:
+        if not os.path.exists(GRAMMAR_LIBRARY):
+            raise FileNotFoundError(f"the tree-sitter grammar library {GRAMMAR_LIBRARY} doesn't exist, "
+                                    f"build it with: python boot.py build-grammar")
+        _js_language = Language(GRAMMAR_LIBRARY, 'javascript')
+    return _js_language
+
+def get_parser() -> Parser:
+    """
+    Returns the JavaScript parser of the current thread (a parser can't be used by several threads at once).
+    """
+    parser = getattr(_parsers, 'parser', None)
+    if parser is None:
+        parser = Parser()
+        parser.set_language(get_language())
+        _parsers.parser = parser
+    return parser
+
+# The keywords of each code feature (features 2-9 of the dataset).
+# A keyword that is a list is a sub keyword: all of its words have to be found, in order.
+PII_KEYWORDS = ['screenshot', ['keypress', 'POST'],
+                'creditcard', 'cookies', 'passwords', 'appData']
+FILE_SYS_ACCESS_KEYWORDS = ['read', 'write', 'file',
+                            'require("fs")', 'os = require("os")', 'platform', 'hostname', 'system32']
+PROCESS_CREATION_KEYWORDS = ['exec', 'spawn', 'fork', 'thread', 'process', 'child_process']
+NETWORK_ACCESS_KEYWORDS = ['send', 'export', 'upload', 'post',
+                           'XMLHttpRequest', 'submit', 'dns', 'nodemailer']
+CRYPTO_FUNCTIONALITY_KEYWORDS = ['crypto', 'mining', 'miner', 'cpu']
+DATA_ENCODING_KEYWORDS = ['encodeURIComponent', 'querystring', 'qs',
+                          'base64', 'btoa', 'atob', 'Buffer', 'JSON.stringify']
+DYNAMIC_CODE_GENERATION_KEYWORDS = ['eval', 'Function']
+PACKAGE_INSTALLATION_KEYWORDS = ['preinstall', 'postinstall', 'install', 'sudo']
+
+# The keywords of all the code features, in the order of the dataset columns
+CODE_FEATURES_KEYWORDS = [PII_KEYWORDS, FILE_SYS_ACCESS_KEYWORDS, PROCESS_CREATION_KEYWORDS,
+                          NETWORK_ACCESS_KEYWORDS, CRYPTO_FUNCTIONALITY_KEYWORDS, DATA_ENCODING_KEYWORDS,
+                          DYNAMIC_CODE_GENERATION_KEYWORDS, PACKAGE_INSTALLATION_KEYWORDS]
 
 def parse_file(file_name):
     logging.debug(f"start func: parse_file")
@@ -37,18 +86,88 @@ def parse_file(file_name):
     # Read the contents of the file using the read() method
     code = file.read()
     # Parse the file and get the syntax tree
-    tree = parser.parse(bytes(code, 'utf-8'))
+    tree = get_parser().parse(bytes(code, 'utf-8'))
     root_node = tree.root_node
     return root_node
 
-def search_keyword_in_package(root_node, keywords, sub_keywords) -> bool:
+def parse_code(code: bytes):
+    """
+    Parses code that is already in memory (e.g. a member of a tarball) and returns the root node of its syntax tree.
+    """
+    logging.debug(f"start func: parse_code")
+    return get_parser().parse(code).root_node
+
+class KeywordMatcher:
+    """
+    A keyword list (in the format of general_search) compiled once for fast matching against the nodes of a code tree.
+
+    The single keywords are kept in a hash set of bytes, so the text of a node is compared without decoding it, and
+    every sub keyword (a list of words) is matched by a small state machine: a sub keyword is found when the words of
+    it that appear in the code appear exactly in its order, the same as comparing the list of found words to it.
+    Nodes that are longer than the longest keyword can never match, so their text is not read at all.
+    """
+
+    def __init__(self, keywords):
+        self.keywords = frozenset(keyword.encode('utf-8') for keyword in keywords if type(keyword) != list)
+        self.sub_keywords = [tuple(word.encode('utf-8') for word in keyword)
+                             for keyword in keywords if type(keyword) == list]
+        # {word: [index of every sub keyword that contains the word]}
+        self.sub_keywords_of_word = {}
+        for index, sub_keyword in enumerate(self.sub_keywords):
+            for word in set(sub_keyword):
+                self.sub_keywords_of_word.setdefault(word, []).append(index)
+        self.max_length = max([len(keyword) for keyword in self.keywords] +
+                              [len(word) for word in self.sub_keywords_of_word] + [0])
+
+    def new_state(self) -> list:
+        """
+        Returns the initial state of the sub keywords for a new search: the number of words of each sub keyword
+        that were found in order, or -1 once a word of it was found out of order.
+        """
+        return [0] * len(self.sub_keywords)
+
+    def match(self, text: bytes, state: list) -> bool:
+        """
+        Returns True if the text of a node is one of the keywords or completes one of the sub keywords.
+        The state (created by new_state) is updated with the words of the sub keywords that were found.
+        """
+        if text in self.keywords:
+            logging.info(f"keyword found!\nThe keyword that was found is: {text.decode()}")
+            return True
+        for index in self.sub_keywords_of_word.get(text, ()):
+            sub_keyword = self.sub_keywords[index]
+            position = state[index]
+            if position < 0 or position >= len(sub_keyword) or sub_keyword[position] != text:
+                # the found words can no longer be equal to the sub keyword
+                state[index] = -1
+                continue
+            state[index] = position + 1
+            if state[index] == len(sub_keyword):
+                logging.info(f"The entire sub keyword was found!\n{[word.decode() for word in sub_keyword]}")
+                return True
+        return False
+
+
+_compiled_keywords = {}
+
+def compile_keywords(keywords) -> KeywordMatcher:
+    """
+    Returns the KeywordMatcher of a keyword list. The matcher is compiled once and reused for every
+    search with an equal keyword list.
+    """
+    key = tuple(tuple(keyword) if type(keyword) == list else keyword for keyword in keywords)
+    if key not in _compiled_keywords:
+        _compiled_keywords[key] = KeywordMatcher(keywords)
+    return _compiled_keywords[key]
+
+def search_keyword_in_package(root_node, keywords, sub_keywords=None) -> bool:
     """
     This function searches for a keyword or sub keyword in the code using a provided root node.
     
     Parameters:
         root_node (Node): The root node of the code tree.
-        keywords (list of str): A list of keywords to search for.
-        sub_keywords (dict of lists): A dictionary where the keys are the names of sub keywords, and the values are the lists of words that make up the sub keyword.
+        keywords (list of str): A list of keywords to search for, the sub keywords are lists of words inside it.
+        sub_keywords (dict of lists): Not used, the sub keywords are taken from keywords. Kept for backward compatibility.
     
     Returns:
         bool: True if a keyword or sub keyword is found, False otherwise.
@@ -58,36 +177,62 @@ def search_keyword_in_package(root_node, keywords, sub_keywords) -> bool:
         * what to improve: have to add the function the ability to count the number of occurrences of all keywords
     """
     logging.debug(f"start func: search_keyword_in_package")
-    found = False
-    # print('root_node: ',root_node, 'children: ', root_node.children)
-    for child in root_node.children:    
-        # search if the child in one of the keywords
-        logging.debug(f"child: {child.text.decode()}")
-        if child.text.decode() in keywords:
-            found = True
-            logging.info(f"keyword found!\nThe keyword that was found is: {child.text.decode()}")
-            break
-        # search if the child in one of the sub keywords
-        elif found == False:
-            for inner_keyword in sub_keywords.values():
-                # logging.debug(f"second loop, inner_keyword: {inner_keyword}")
-                if child.text.decode() in inner_keyword[0]:
-                    logging.info(f"sub keyword found!\nThe keyword that was found is: {child.text.decode()}")
-                    inner_keyword[1].append(child.text.decode())
-                    if inner_keyword[1] == inner_keyword[0]:
-                        logging.info(f"The entire sub keyword was found!\n{inner_keyword[1]} == {inner_keyword[0]}")
-                        found = True
-                        break
-        # recursion 
-        if found == False:
-            logging.debug("calling recursion")
-            found = search_keyword_in_package(child, keywords, sub_keywords)
-            if found:
-                break
-    
+    found = search_keywords_lists_in_package(root_node, [keywords])[0] == 1
     logging.debug(f"results of search_keyword_in_code: {found}")
     return found
 
+def _trie_regex(words) -> bytes:
+    """
+    Builds a regular expression (bytes) that matches any of the words, with the common prefixes of the words
+    factored out (a trie), so the regex engine checks every position of the text against all the words at once
+    instead of trying them one by one.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for byte in word:
+            node = node.setdefault(bytes([byte]), {})
+        node[b''] = {}  # the end of a word
+
+    def to_regex(node) -> bytes:
+        if b'' in node and len(node) == 1:
+            return b''
+        alternatives = [re.escape(char) + to_regex(child) for char, child in sorted(node.items()) if char]
+        optional = b'' in node
+        if len(alternatives) == 1 and not optional:
+            return alternatives[0]
+        regex = b'(?:' + b'|'.join(alternatives) + b')'
+        return regex + b'?' if optional else regex
+
+    return to_regex(trie)
+
+@functools.lru_cache(maxsize=None)
+def _compile_substrings(keywords: tuple) -> re.Pattern:
+    if not keywords:
+        return re.compile(b'(?!)')  # never matches
+    return re.compile(_trie_regex(sorted(set(keyword.encode('utf-8') for keyword in keywords))))
+
+def compile_substrings(keywords) -> re.Pattern:
+    """
+    Compiles a list of keywords into one bytes pattern that finds any of them in a single pass over the data.
+    The pattern is compiled once and reused for every search with the same keywords.
+    """
+    return _compile_substrings(tuple(keywords))
+
+def search_substring_in_file(file_path: str, pattern: re.Pattern) -> bool:
+    """
+    Returns True if one of the keywords of a pattern (see compile_substrings) is in the file.
+    The file is memory-mapped and searched as bytes, so any encoding can be searched and the search stops at the
+    first match without reading the rest of the file.
+    """
+    with open(file_path, "rb") as file:
+        try:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return pattern.search(data) is not None
+        except ValueError:
+            # empty files can't be memory-mapped
+            return False
+
 def search_substring_in_package(directory_path: str, keywords: str) -> int:
     """
     This function searches for a keyword in the files within a directory.
@@ -101,17 +246,245 @@ def search_substring_in_package(directory_path: str, keywords: str) -> int:
     """
     logging.debug(f"start func: search_substring_in_package")
     logging.info(f"directory_path: {directory_path}")
+    pattern = compile_substrings(keywords)
     for dirpath, dirnames, filenames in os.walk(directory_path):
         for filename in filenames:
             file_path = os.path.join(dirpath, filename)
             if filename.endswith(".js") or filename.endswith(".ts"):
-                with open(file_path, "r") as file:
-                    file_content = file.read()
-                    for keyword in keywords:
-                        if keyword in file_content:
-                            return 1
+                try:
+                    if search_substring_in_file(file_path, pattern):
+                        return 1
+                except OSError as e:
+                    logging.warning(f"can't read {file_path}: {e}")
     return 0
 
+# Keywords of the geolocation feature: an API that gets the location of the device base on its IP.
+GEOLOCATION_KEYWORDS = ['ipgeolocation']
+
+# Pruning rules for scan_package_directory: fnmatch patterns of directory names that are not scanned.
+# The features of the dataset were extracted without pruning, so none of them is used by default.
+PRUNE_NESTED_NODE_MODULES = ['node_modules']
+PRUNE_GIT = ['.git']
+PRUNE_TEST_FIXTURES = ['__fixtures__', 'fixtures', '__tests__', 'test', 'tests']
+
+def is_minified_by_entropy(entropy_values) -> Literal[1, 0]:
+    """
+    Decides from the entropy values of the files of a package whether its code is minified:
+    the average entropy is above 5 and the standard deviation of the entropy is above 0.1.
+
+    Parameters:
+        entropy_values (list of float): The entropy of every non-empty '.js'/'.ts' file of the package.
+
+    Returns:
+        int: 1 if the code is minified, 0 otherwise.
+    """
+    is_minified = 0
+
+    # Calculate the average entropy and standard deviation of the entropy values
+    if len(entropy_values) != 0:
+        avg_entropy = sum(entropy_values) / len(entropy_values)
+        std_dev_entropy = math.sqrt(
+            sum((x - avg_entropy)**2 for x in entropy_values) / len(entropy_values))
+
+        # Create a feature indicating whether the data is minified or not
+        AVG_ENTROPY_THRESHOLD = 5
+        STD_DEV_ENTROPY_THRESHOLD = 0.1
+        if avg_entropy > AVG_ENTROPY_THRESHOLD and std_dev_entropy > STD_DEV_ENTROPY_THRESHOLD:
+            is_minified = 1
+        logging.info(f'avg_entropy: {avg_entropy}')
+        logging.info(f'std_dev_entropy: {std_dev_entropy}')
+        logging.info(f'is_minified: {is_minified}')
+
+    return is_minified
+
+class PackageStats:
+    """
+    The statistics of the files of a directory tree that the directory features (10-15) are computed from.
+    """
+
+    def __init__(self):
+        self.num_of_files = 0
+        self.num_of_code_files = 0  # '.js'/'.ts' files
+        self.code_bytes = 0
+        self.entropy_values = []  # the entropy of every non-empty '.js'/'.ts' file
+        self.longest_line = 0
+        self.geolocation = 0
+        self.has_license = 0
+
+    def add_file(self, name: str, path: str, geolocation_pattern: re.Pattern, cache=None) -> None:
+        """
+        Adds a file to the statistics, the contents of '.js'/'.ts' files are read once.
+        geolocation_pattern is the compiled keywords of the geolocation feature (see compile_substrings),
+        and the byte statistics of the file are taken from the cache when it's given: a ByteStatisticsBatch (the
+        statistics are added when it's flushed) or a FeatureCache (looked up at once).
+        """
+        if not name.endswith(".js") and not name.endswith(".ts"):
+            self.add_data(name, None, geolocation_pattern, cache)
+            return
+
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError as e:
+            logging.warning(f"can't read {path}: {e}")
+            data = b''
+        self.add_data(name, data, geolocation_pattern, cache)
+
+    def add_data(self, name: str, data, geolocation_pattern: re.Pattern, cache=None) -> None:
+        """
+        Adds a file that is already in memory to the statistics, the same as add_file.
+        The data of files that aren't '.js'/'.ts' files isn't used and can be None.
+        """
+        self.num_of_files += 1
+        if name == 'LICENSE':
+            self.has_license = 1
+        if not name.endswith(".js") and not name.endswith(".ts"):
+            return
+
+        self.num_of_code_files += 1
+        if not data:
+            return
+        self.code_bytes += len(data)
+        if not self.geolocation and geolocation_pattern.search(data) is not None:
+            self.geolocation = 1
+        if isinstance(cache, ByteStatisticsBatch):
+            cache.add(self, data)
+        elif cache is not None:
+            batch = ByteStatisticsBatch(cache)
+            batch.add(self, data)
+            batch.flush()
+        else:
+            _, entropy, longest_line = byte_statistics(data)
+            self.add_byte_statistics(entropy, longest_line)
+
+    def add_byte_statistics(self, entropy: float, longest_line: int) -> None:
+        self.entropy_values.append(entropy)
+        self.longest_line = max(self.longest_line, longest_line)
+
+    def features(self) -> dict:
+        """
+        Returns the directory features: {'geolocation', 'minified_code', 'no_content', 'longest_line',
+        'num_of_files', 'has_license'}
+        """
+        return {
+            'geolocation': self.geolocation,
+            'minified_code': is_minified_by_entropy(self.entropy_values),
+            'no_content': 0 if self.num_of_code_files > 0 else 1,
+            'longest_line': self.longest_line,
+            'num_of_files': self.num_of_files,
+            'has_license': self.has_license,
+        }
+
+class ByteStatisticsBatch:
+    """
+    Takes the byte statistics of files from a FeatureCache in batches instead of with a query per file: the files
+    are added with the PackageStats they belong to, and every max_files files (or max_bytes bytes) their hashes are
+    looked up with one query, the statistics of the missing files are computed and stored with one write, and all
+    are added to their PackageStats. flush() the batch before using the features of the statistics.
+    """
+
+    def __init__(self, cache, max_files: int = 1000, max_bytes: int = 32 * 1024 * 1024):
+        self.cache = cache
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.pending = []  # (PackageStats, content hash, data)
+        self.pending_bytes = 0
+
+    def add(self, stats: PackageStats, data: bytes) -> None:
+        self.pending.append((stats, content_hash(data), data))
+        self.pending_bytes += len(data)
+        if len(self.pending) >= self.max_files or self.pending_bytes >= self.max_bytes:
+            self.flush()
+
+    def flush(self) -> None:
+        pending, self.pending, self.pending_bytes = self.pending, [], 0
+        if not pending:
+            return
+        cached = self.cache.get_byte_statistics([file_hash for _, file_hash, _ in pending])
+        computed = {}
+        for stats, file_hash, data in pending:
+            statistics = cached.get(file_hash) or computed.get(file_hash)
+            if statistics is None:
+                _, entropy, longest_line = byte_statistics(data)
+                statistics = computed[file_hash] = (entropy, longest_line)
+            stats.add_byte_statistics(*statistics)
+        if computed:
+            self.cache.put_byte_statistics(computed)
+
+def _is_pruned(name: str, prune_dirs) -> bool:
+    return any(fnmatch.fnmatch(name, pattern) for pattern in prune_dirs)
+
+def scan_package_directory(directory_path: str, prune_dirs=(), geolocation_keywords=GEOLOCATION_KEYWORDS, cache=None) -> dict:
+    """
+    Computes all the directory features of a package (features 10-15 of the dataset) in a single pass:
+    every directory is listed once with os.scandir and every '.js'/'.ts' file is read once.
+
+    Parameters:
+        directory_path (str): The path to the directory of the package.
+        prune_dirs (list of str): fnmatch patterns of the names of directories under directory_path that are
+            not scanned (e.g. PRUNE_NESTED_NODE_MODULES + PRUNE_GIT). Nothing is pruned by default.
+        geolocation_keywords (list of str): The keywords of the geolocation feature.
+        cache (FeatureCache, optional): The cache of the byte statistics of files by their contents.
+
+    Returns:
+        dict: {'geolocation', 'minified_code', 'no_content', 'longest_line', 'num_of_files', 'has_license'}
+    """
+    logging.debug("start func: scan_package_directory")
+    logging.info(f"directory_path: {directory_path}")
+
+    geolocation_pattern = compile_substrings(geolocation_keywords)
+    stats = PackageStats()
+    batch = ByteStatisticsBatch(cache) if cache is not None else None
+
+    directories = [directory_path]
+    while directories:
+        dirpath = directories.pop()
+        try:
+            entries = list(os.scandir(dirpath))
+        except OSError as e:
+            logging.warning(f"can't scan {dirpath}: {e}")
+            continue
+        for entry in entries:
+            # the same classification as os.walk: symbolic links to directories are listed but not followed
+            if entry.is_dir():
+                if not entry.is_symlink() and not _is_pruned(entry.name, prune_dirs):
+                    directories.append(entry.path)
+                continue
+            stats.add_file(entry.name, entry.path, geolocation_pattern, batch)
+
+    if batch is not None:
+        batch.flush()
+    return stats.features()
+
+def read_package_name(package_dir: str) -> Union[str, None]:
+    """
+    Returns the name in the package.json file of a directory, or None if it has no valid package.json file.
+    """
+    try:
+        with open(os.path.join(package_dir, 'package.json'), 'r') as file:
+            name = json.load(file).get('name')
+    except (OSError, ValueError, AttributeError):
+        return None
+    return name if isinstance(name, str) else None
+
+def resolve_package_root(workspace: str, package_name: str) -> str:
+    """
+    Returns the root directory of a package in a workspace: the directory whose package.json has the name of
+    the package, which is normally workspace/package_name (scoped names like '@scope/name' are nested directories).
+
+    Parameters:
+        workspace (str): The node_modules directory the package was installed in.
+        package_name (str): The name of the package.
+
+    Returns:
+        str: The root directory of the package.
+    """
+    candidate = os.path.normpath(os.path.join(workspace, *package_name.split('/')))
+    if read_package_name(candidate) == package_name:
+        return candidate
+    logging.warning(f"no package.json of {package_name} was found in {workspace}, using {candidate}")
+    return candidate
+
 def bitwise_operation(list1, list2, operation) -> list:
     """
     Perform a bitwise operation between elements of two lists of 1s and 0s.
@@ -143,18 +516,155 @@ def bitwise_operation(list1, list2, operation) -> list:
 def general_search(root_node,keywords) -> Literal[1, 0]:
     logging.debug("start func: general_search")
 
-     # Traverse the syntax tree and check for the specific line of code
-    sub_keywords = {} # {index of the sublist in keywords: keyword, [words that found]}
-    # for each sublist in keywords, add the index and the keyword
-    for index, keyword in enumerate(keywords):
-      if type(keyword) == list:
-        sub_keywords[index] = [keyword, []]
-
     is_using = 0
-    if search_keyword_in_package(root_node, keywords, sub_keywords):
+    if search_keyword_in_package(root_node, keywords):
         is_using = 1
-    
-    return is_using 
+
+    return is_using
+
+def search_keywords_lists_in_package(root_node, keywords_lists) -> list:
+    """
+    This function searches for several keyword lists in the code with a single traversal of the code tree.
+    Every keyword list gives the same result as calling general_search with it, but the text of each node
+    is read only once and the traversal stops as soon as all the keyword lists were found.
+    The traversal uses an explicit stack, so deep trees (e.g. minified bundles) don't reach the recursion limit.
+
+    Parameters:
+        root_node (Node): The root node of the code tree.
+        keywords_lists (list of lists): The keyword lists to search for, in the format of general_search.
+
+    Returns:
+        list of int: 1 for every keyword list that was found and 0 otherwise, in the order of keywords_lists.
+    """
+    logging.debug("start func: search_keywords_lists_in_package")
+
+    matchers = [compile_keywords(keywords) for keywords in keywords_lists]
+    states = [matcher.new_state() for matcher in matchers]
+    max_length = max([matcher.max_length for matcher in matchers] + [0])
+    results = [0] * len(keywords_lists)
+
+    remaining = len(keywords_lists)
+    # visit the nodes in pre-order, the same order as a recursive traversal
+    stack = list(reversed(root_node.children))
+    while stack and remaining > 0:
+        child = stack.pop()
+        # a node that is longer than all the keywords can't be one of them
+        if child.end_byte - child.start_byte <= max_length:
+            text = child.text
+            for i, matcher in enumerate(matchers):
+                if not results[i] and matcher.match(text, states[i]):
+                    results[i] = 1
+                    remaining -= 1
+        stack.extend(reversed(child.children))
+
+    logging.debug(f"results of search_keywords_lists_in_package: {results}")
+    return results
+
+def search_code_features(root_node, keywords_lists=CODE_FEATURES_KEYWORDS) -> list:
+    """
+    Searches all the keyword lists of the code features in a syntax tree.
+    Returns 1 for every keyword list that was found and 0 otherwise.
+    """
+    return search_keywords_lists_in_package(root_node, keywords_lists)
+
+def extract_code_features(file_name, keywords_lists=CODE_FEATURES_KEYWORDS) -> list:
+    """
+    Parses a file once and searches all the keyword lists of the code features in its syntax tree.
+
+    Parameters:
+        file_name (str): The path of the '.js' or '.json' file.
+        keywords_lists (list of lists): The keyword lists to search for (default: the keywords of features 2-9).
+
+    Returns:
+        list of int: 1 for every keyword list that was found in the file and 0 otherwise.
+    """
+    logging.debug("start func: extract_code_features")
+    return search_code_features(parse_file(file_name), keywords_lists)
+
+# The number of worker processes that parse the files of a package in parallel (1 disables the pool),
+# and the smallest number of files that is sent to the pool, below it the files are parsed serially.
+EXTRACTION_WORKERS = int(os.environ.get('SAFEDEP_EXTRACTION_WORKERS', os.cpu_count() or 1))
+PARALLEL_MIN_FILES = int(os.environ.get('SAFEDEP_PARALLEL_MIN_FILES', 32))
+
+_extraction_pool = None
+_extraction_pool_lock = threading.Lock()
+
+def _init_extraction_worker() -> None:
+    # the tree-sitter language and the parser are loaded once per worker, before its first file
+    logging.debug(f"extraction worker started, language: {get_language().name}")
+
+def _get_extraction_pool(workers: int) -> ProcessPoolExecutor:
+    global _extraction_pool
+    with _extraction_pool_lock:
+        if _extraction_pool is None:
+            # the server is multi-threaded by the time the pool is created (Flask, the analysis jobs, the MongoDB
+            # client), and a forked child can deadlock on a lock that another thread held, so the workers are forked
+            # from a fork server that preloads only this module (the workers still import the main module, which
+            # must not start the threads of the server there, see SERVER_PROCESS in app.py)
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload([__name__])
+            _extraction_pool = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                                   initializer=_init_extraction_worker)
+        return _extraction_pool
+
+def extract_code_features_of_files(file_paths, keywords_lists=CODE_FEATURES_KEYWORDS, workers=None, cache=None) -> list:
+    """
+    Extracts the code features of several files, spread over a pool of worker processes.
+    Small batches (less than PARALLEL_MIN_FILES files) are extracted serially, where the pool costs more than it saves.
+
+    Parameters:
+        file_paths (list of str): The paths of the '.js' or '.json' files.
+        keywords_lists (list of lists): The keyword lists to search for (default: the keywords of features 2-9).
+        workers (int, optional): The number of worker processes (default: EXTRACTION_WORKERS).
+        cache (FeatureCache, optional): The cache of the features of files by their contents. Files that are in
+            the cache are not parsed, and the features of the other files are added to it.
+
+    Returns:
+        list of lists: The result of extract_code_features for every file, in the order of file_paths.
+    """
+    logging.debug("start func: extract_code_features_of_files")
+    if cache is None:
+        return _extract_code_features_of_files(file_paths, keywords_lists, workers)
+
+    hashes = []
+    for file_path in file_paths:
+        with open(file_path, 'rb') as file:
+            hashes.append(content_hash(file.read()))
+    version = detector_version(keywords_lists)
+    cached = cache.get_code_features(hashes, version)
+    missing = [i for i, file_hash in enumerate(hashes) if file_hash not in cached]
+    logging.info(f"feature cache: {len(file_paths) - len(missing)} hits, {len(missing)} misses")
+
+    extracted = _extract_code_features_of_files([file_paths[i] for i in missing], keywords_lists, workers)
+    new_features = {hashes[i]: features for i, features in zip(missing, extracted)}
+    if new_features:
+        cache.put_code_features(new_features, version)
+    return [cached[file_hash] if file_hash in cached else new_features[file_hash] for file_hash in hashes]
+
+def _extract_code_features_of_files(file_paths, keywords_lists, workers) -> list:
+    workers = EXTRACTION_WORKERS if workers is None else workers
+    if workers <= 1 or len(file_paths) < PARALLEL_MIN_FILES:
+        return [extract_code_features(file_path, keywords_lists) for file_path in file_paths]
+
+    # send the files in batches, so every worker gets a few batches to balance the load
+    chunksize = max(1, len(file_paths) // (workers * 4))
+    pool = _get_extraction_pool(workers)
+    try:
+        return list(pool.map(functools.partial(extract_code_features, keywords_lists=keywords_lists),
+                             file_paths, chunksize=chunksize))
+    except BrokenProcessPool:
+        # a worker died (e.g. killed by the OOM killer): the pool can't be used anymore, the next batch starts a new
+        # one, and this batch is extracted serially
+        logging.exception("the feature extraction pool is broken, extracting the files serially")
+        _reset_extraction_pool(pool)
+        return [extract_code_features(file_path, keywords_lists) for file_path in file_paths]
+
+def _reset_extraction_pool(pool: ProcessPoolExecutor) -> None:
+    global _extraction_pool
+    with _extraction_pool_lock:
+        if _extraction_pool is pool:
+            _extraction_pool = None
+    pool.shutdown(wait=False)
 
 def extract_package_details(package_name: str) -> tuple:
     """
@@ -238,6 +748,57 @@ def write_each_package_and_version_to_csv_and_create_dir(package_features, main_
             writer = csv.writer(file)
             writer.writerow([version, datetime.datetime.now().isoformat()])
             
+_NEWLINE = ord('\n')
+_CARRIAGE_RETURN = ord('\r')
+
+def byte_statistics(data: bytes) -> tuple:
+    """
+    Computes the byte statistics of the contents of a file in a single vectorized pass:
+    the byte histogram, the entropy and the length of the longest line.
+
+    The longest line is measured the same as reading the file in text mode: in characters (UTF-8 continuation
+    bytes aren't counted), with universal newlines ('\n', '\r\n' and '\r'), and the line ending counts as one character.
+
+    Parameters:
+        data (bytes): The contents of the file.
+
+    Returns:
+        tuple: (histogram (np.ndarray of 256 counts), entropy (float), longest line (int))
+    """
+    # numpy is loaded by the first file, not by importing the module
+    import numpy as np
+    array = np.frombuffer(data, dtype=np.uint8)
+    histogram = np.bincount(array, minlength=256)
+    if array.size == 0:
+        return histogram, 0, 0
+
+    probabilities = histogram[histogram > 0] / array.size
+    entropy = float(-(probabilities * np.log2(probabilities)).sum())
+
+    # the number of characters up to (and including) every byte
+    characters = np.cumsum((array & 0xC0) != 0x80)
+    is_newline = array == _NEWLINE
+    is_carriage_return = array == _CARRIAGE_RETURN
+    # a '\r' that is followed by '\n' is part of a '\r\n' line ending that ends at the '\n'
+    crlf = np.zeros(array.size, dtype=bool)
+    crlf[1:] = is_newline[1:] & is_carriage_return[:-1]
+    lone_carriage_return = is_carriage_return.copy()
+    lone_carriage_return[:-1] &= ~is_newline[1:]
+    line_ends = np.flatnonzero(is_newline | lone_carriage_return)
+
+    ends = characters[line_ends]
+    lengths = np.diff(ends, prepend=0) - crlf[line_ends]
+    longest_line = int(lengths.max()) if lengths.size > 0 else 0
+    # the last line, if the file doesn't end with a line ending
+    last_line = int(characters[-1]) - (int(ends[-1]) if ends.size > 0 else 0)
+    return histogram, entropy, max(longest_line, last_line)
+
+def find_longest_line_in_the_data(data: bytes) -> int:
+    """
+    Returns the length of the longest line of the contents of a file, the same as reading the file in text mode.
+    """
+    return byte_statistics(data)[2]
+
 def calculate_entropy(data) -> Union[float, Literal[0]]:
     """
     Calculates the entropy of the input data.
@@ -250,17 +811,8 @@ def calculate_entropy(data) -> Union[float, Literal[0]]:
     """
     logging.debug("start func: calculate_entropy")
 
-    entropy = 0
-    # Iterate over all possible values of bytes (0 to 255)
-    for x in range(256):
-        # Calculate the probability of the byte value x appearing in the data
-        p_x = float(data.count(x.to_bytes(1, "big")))/len(data)
-        # If the probability is greater than 0, add to the entropy value
-        if p_x > 0:
-            entropy -= p_x * math.log2(p_x)
-            
-    # Return the entropy value
-    return entropy
+    # the entropy of the byte histogram, in one pass over the data
+    return byte_statistics(data)[1]
 
 def find_longest_line_in_the_file(filename) -> int:
     """
@@ -273,12 +825,7 @@ def find_longest_line_in_the_file(filename) -> int:
     int: The length of the longest line in the file.
     """
     logging.debug("start func: find_longest_line")
-    
-    with open(filename, 'r') as file:
-        longest_line = 0
-        for line in file:
-            if len(line) > longest_line:
-                longest_line = len(line)
-        # print('filename: ',filename,' longest_line: ', longest_line)
-    # print('file name: ', filename,'longest_line: ', longest_line)           
-    return longest_line
\ No newline at end of file
+
+    with open(filename, 'rb') as file:
+        data = file.read()
+    return find_longest_line_in_the_data(data)
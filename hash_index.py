@@ -0,0 +1,121 @@
+import csv
+import logging
+import os
+import threading
+import time
+
+"""
+An in-memory index of the hashes of known malicious packages (the first column of a CSV feed such as
+malicious_hash.csv), loaded once and reloaded when the file changes, instead of scanning the file for every lookup.
+"""
+
+# How often the file of the feed is checked for changes (seconds)
+RELOAD_CHECK_INTERVAL = 5
+
+
+class HashIndex:
+    """
+    The set of hashes of a feed file. The file is reloaded when its modification time or size changes (checked at
+    most every RELOAD_CHECK_INTERVAL seconds); the new set is built aside and swapped in at once, so lookups never see
+    a partly loaded feed and never wait for a reload: they use the previous set until it's swapped. If a reload
+    fails, the previous set is kept.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # held while the feed is reloaded, lookups only try it (without waiting) to start a background reload
+        self.lock = threading.Lock()
+        self.signature = None
+        self.checked = 0
+        self.loads = 0
+        self.hashes = frozenset()
+        self.reload()
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def reload(self, force: bool = False, blocking: bool = True) -> bool:
+        """
+        Loads the feed if the file changed since it was loaded (or always, if force is set).
+        If another thread is reloading it, waits for it, or returns at once when blocking is False.
+        Returns True if the feed was loaded.
+        """
+        if not self.lock.acquire(blocking):
+            return False
+        try:
+            return self._load(force)
+        finally:
+            self.lock.release()
+
+    def _load(self, force: bool) -> bool:
+        # called with the lock held
+        self.checked = time.monotonic()
+        signature = self._file_signature()
+        if not force and signature == self.signature:
+            return False
+        try:
+            with open(self.path, 'r') as csvfile:
+                hashes = frozenset(row[0] for row in csv.reader(csvfile) if row)
+        except OSError as e:
+            logging.warning(f"failed to load the hashes of {self.path}: {e}")
+            return False
+        self.hashes = hashes
+        self.signature = signature
+        self.loads += 1
+        logging.info(f"loaded {len(hashes)} hashes from {self.path}")
+        return True
+
+    def _reload_in_background(self) -> None:
+        try:
+            self._load(force=False)
+        except Exception:
+            logging.exception(f"failed to reload the hashes of {self.path}")
+        finally:
+            self.lock.release()
+
+    def _current(self) -> frozenset:
+        # a due check starts a reload in a background thread (unless one is running), and the lookup goes on with
+        # the current set: reading a large feed never delays a request
+        if time.monotonic() - self.checked >= RELOAD_CHECK_INTERVAL and self.lock.acquire(blocking=False):
+            try:
+                threading.Thread(target=self._reload_in_background, name='hash-index reload', daemon=True).start()
+            except BaseException:
+                self.lock.release()
+                raise
+        return self.hashes
+
+    def contains(self, value: str) -> bool:
+        """
+        Returns True if the hash is in the feed.
+        """
+        return value in self._current()
+
+    def contains_many(self, values) -> dict:
+        """
+        Returns {hash: True if it's in the feed} for many hashes, against the same version of the feed.
+        """
+        hashes = self._current()
+        return {value: value in hashes for value in values}
+
+    def stats(self) -> dict:
+        return {'path': self.path, 'hashes': len(self.hashes), 'loads': self.loads}
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_hash_index(path: str) -> HashIndex:
+    """
+    Returns the (shared) index of the feed file.
+    """
+    key = os.path.abspath(path)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = HashIndex(path)
+        return index
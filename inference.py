@@ -0,0 +1,97 @@
+import threading
+import warnings
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+
+"""
+Batched inference of the package classifier: the features of packages are scored as a NumPy matrix with a fixed
+column order, a whole batch in one call of the model, and the predictions of feature vectors that were already
+scored are memoized. numpy is imported by the first prediction, not by importing the module.
+"""
+
+# The features of the model, in the order of its training columns (dataset-train.csv without package, version, label)
+FEATURE_COLUMNS = ['PII', 'file_sys_access', 'file_process_creation', 'network_access', 'cryptographic_functionality',
+                   'data_encoding', 'dynamic_code_generation', 'package_installation', 'geolocation', 'minified_code',
+                   'no_content', 'longest_line', 'num_of_files', 'has_license']
+# The maximal number of memoized predictions
+PREDICTION_CACHE_SIZE = 100000
+
+
+def features_matrix(rows) -> 'np.ndarray':
+    """
+    Returns the feature matrix of packages (n x len(FEATURE_COLUMNS), float64) from their features: lists in the
+    order of FEATURE_COLUMNS, or dicts keyed by the names of FEATURE_COLUMNS, or a matrix.
+    """
+    import numpy as np
+    if isinstance(rows, np.ndarray):
+        matrix = rows.astype(np.float64, copy=False)
+    else:
+        matrix = np.array([[row[column] for column in FEATURE_COLUMNS] if isinstance(row, dict) else row
+                           for row in rows], dtype=np.float64)
+    if matrix.ndim != 2 or matrix.shape[1] != len(FEATURE_COLUMNS):
+        raise ValueError(f"expected {len(FEATURE_COLUMNS)} features per package, got shape {matrix.shape}")
+    return matrix
+
+
+class Predictor:
+    """
+    Scores packages with a fitted classifier (the VotingClassifier of utils/predictor/model.pkl).
+    """
+
+    def __init__(self, model, cache_size: int = PREDICTION_CACHE_SIZE):
+        names = getattr(model, 'feature_names_in_', None)
+        if names is not None and list(names) != FEATURE_COLUMNS:
+            raise ValueError(f"the model was trained on the columns {list(names)}, expected {FEATURE_COLUMNS}")
+        self.model = model
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # {bytes of a feature vector: prediction}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def predict_batch(self, rows) -> 'np.ndarray':
+        """
+        Returns the predictions ('benign' / 'malicious') of a batch of packages, see features_matrix for the rows.
+        The feature vectors that aren't memoized are scored together in one call of the model.
+        """
+        import numpy as np
+        matrix = features_matrix(rows)
+        keys = [row.tobytes() for row in matrix]
+        predictions = np.empty(len(keys), dtype=object)
+        missing = []
+        with self.lock:
+            for i, key in enumerate(keys):
+                prediction = self.cache.get(key)
+                if prediction is None:
+                    missing.append(i)
+                else:
+                    self.cache.move_to_end(key)
+                    predictions[i] = prediction
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        if missing:
+            with warnings.catch_warnings():
+                # the model was fitted on a DataFrame, its columns were checked against FEATURE_COLUMNS once (in
+                # __init__) instead of naming the columns of every matrix
+                warnings.filterwarnings('ignore', message='X does not have valid feature names')
+                scored = self.model.predict(matrix[missing])
+            predictions[missing] = scored
+            with self.lock:
+                for i, prediction in zip(missing, scored):
+                    self.cache[keys[i]] = prediction
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return predictions
+
+    def predict(self, features) -> 'np.ndarray':
+        """
+        Returns the prediction of one package as an array of one prediction, like model.predict.
+        """
+        return self.predict_batch([features])
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'entries': len(self.cache), 'hits': self.hits, 'misses': self.misses}
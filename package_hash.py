@@ -0,0 +1,256 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+The hash of a package that clones are detected by, in one of two modes:
+
+'compat': an md5 of all the files of the package, visited in a deterministic order, where the `name` and `version`
+    fields of `package.json` files are ignored - the digest of the hashes in malicious_hash.csv.
+'merkle': a Merkle tree of the package: every file is hashed on its own (in parallel), and the digest of a directory is
+    the hash of the names and digests of its entries, so the digests of all the sub directories come for free.
+
+Files are read in chunks of HASH_CHUNK_SIZE bytes in both modes, never whole.
+"""
+
+# The mode of the package hash: 'compat' or 'merkle' (the feed of malicious hashes must use the same mode)
+HASH_MODE = os.environ.get('SAFEDEP_HASH_MODE', 'compat')
+# The size of the chunks that files are read in (bytes)
+HASH_CHUNK_SIZE = 1024 * 1024
+# The number of threads that hash the files of a package in the merkle mode
+HASH_WORKERS = int(os.environ.get('SAFEDEP_HASH_WORKERS', min(8, os.cpu_count() or 1)))
+
+
+def hash_order_key(relpath: str) -> tuple:
+    """
+    The order that hash_package visits the files of a package in: the files of a directory (sorted by name) and
+    then its sub directories (sorted by name), recursively - the order of a sorted os.walk.
+    """
+    parts = relpath.split('/')
+    return tuple((1, part) for part in parts[:-1]) + ((0, parts[-1]),)
+
+
+def package_json_for_hash(data: bytes) -> bytes:
+    """
+    Returns the contents of a package.json file as they are hashed: without its name and version.
+    """
+    pkg = json.loads(data)
+    pkg["name"] = ""
+    pkg["version"] = ""
+    return json.dumps(pkg, sort_keys=True).encode("utf-8")
+
+
+def _update_from_file(m, path: str) -> None:
+    """
+    Feeds the contents of a file to a hash object, chunk by chunk (package.json files without name and version).
+    """
+    if os.path.basename(path) == "package.json":
+        with open(path, "rb") as f:
+            m.update(package_json_for_hash(f.read()))
+        return
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            m.update(chunk)
+
+
+def compat_digest(root: str) -> str:
+    """
+    Computes the compat hash of the package in a directory: an md5 of all files under root, visiting them in
+    deterministic order. Files that can't be read are hashed by their path only.
+    The files are fed to one md5 in order, so unlike the merkle hash it runs in a single thread.
+    """
+    m = hashlib.md5()
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            m.update(f"{os.path.relpath(path, root)}\n".encode("utf-8"))
+            try:
+                _update_from_file(m, path)
+            except (OSError, ValueError):
+                print(f'ERROR: path {path}')
+    return m.hexdigest()
+
+
+def file_digest(path: str) -> str:
+    """
+    Returns the merkle digest of a file (package.json files without name and version), or '' if it can't be read.
+    """
+    try:
+        m = hashlib.blake2b(digest_size=16)
+        _update_from_file(m, path)
+        return m.hexdigest()
+    except (OSError, ValueError) as e:
+        logging.warning(f"failed to hash {path}: {e}")
+        return ''
+
+
+def directory_digest(entries) -> str:
+    """
+    Returns the merkle digest of a directory from its entries: (kind, name, digest) where kind is 'f' for files and
+    'd' for directories.
+    """
+    m = hashlib.blake2b(digest_size=16)
+    for kind, name, digest in sorted(entries):
+        m.update(f"{kind} {name}\0{digest}\n".encode("utf-8"))
+    return m.hexdigest()
+
+
+def _directory_digests(files: dict) -> dict:
+    """
+    Builds the digests of all the directories of a tree from the digests of its files ({relative path: digest}).
+    Returns {relative directory ('' for the root): digest}.
+    """
+    children = {'': []}
+    for relpath, digest in files.items():
+        parts = relpath.split('/')
+        for depth in range(1, len(parts)):
+            directory = '/'.join(parts[:depth])
+            if directory not in children:
+                children[directory] = []
+                children['/'.join(parts[:depth - 1])].append(('d', parts[depth - 1], directory))
+        children['/'.join(parts[:-1])].append(('f', parts[-1], digest))
+
+    digests = {}
+    # the deepest directories first, so the digests of the sub directories are known
+    for directory in sorted(children, key=lambda d: d.count('/') + (d != ''), reverse=True):
+        digests[directory] = directory_digest(
+            (kind, name, digests[value] if kind == 'd' else value) for kind, name, value in children[directory])
+    return digests
+
+
+def file_digests(root: str, workers: int = HASH_WORKERS) -> dict:
+    """
+    Computes the merkle digests of the files of the package in a directory, on a pool of threads.
+
+    Returns:
+        dict: {relative path ('/' separated): digest} of every file of the package.
+    """
+    paths = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            paths[os.path.relpath(path, root).replace(os.sep, '/')] = path
+    if workers > 1 and len(paths) > 1:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hash') as executor:
+            digests = executor.map(file_digest, paths.values())
+            return dict(zip(paths, digests))
+    return {relpath: file_digest(path) for relpath, path in paths.items()}
+
+
+def merkle_digests(root: str, workers: int = HASH_WORKERS) -> dict:
+    """
+    Computes the merkle digests of the package in a directory, hashing its files on a pool of threads.
+
+    Returns:
+        dict: {relative directory ('' for the root): digest} of every directory of the package.
+    """
+    return _directory_digests(file_digests(root, workers))
+
+
+def _contents_for_hash(relpath: str, data: bytes):
+    """
+    Returns the contents of a file as they are hashed, or None if they can't be (a package.json that isn't JSON).
+    """
+    if relpath.rsplit('/', 1)[-1] != "package.json":
+        return data
+    try:
+        return package_json_for_hash(data)
+    except ValueError:
+        return None
+
+
+def _entry_digest(contents) -> str:
+    if contents is None:
+        return ''
+    m = hashlib.blake2b(digest_size=16)
+    m.update(contents)
+    return m.hexdigest()
+
+
+def file_digests_of_entries(entries) -> dict:
+    """
+    Computes the merkle digests of the files of a package from (relative path, contents) entries.
+    """
+    return {relpath: _entry_digest(_contents_for_hash(relpath, data)) for relpath, data in entries}
+
+
+def merkle_digests_of_entries(entries) -> dict:
+    """
+    Computes the merkle digests of a package from its files: (relative path, contents) in any order.
+    """
+    return _directory_digests(file_digests_of_entries(entries))
+
+
+def hash_package(root: str, mode: str = None) -> str:
+    """
+    Computes the hash of the package in a directory, in the given mode (default: HASH_MODE).
+    """
+    mode = mode or HASH_MODE
+    if mode == 'merkle':
+        return merkle_digests(root)['']
+    if mode == 'compat':
+        return compat_digest(root)
+    raise ValueError(f"unknown hash mode: {mode}")
+
+
+class PackageHasher:
+    """
+    Computes the hash of a package (in the given mode, default: HASH_MODE) and the merkle digests of its files from
+    its files, added one at a time in any order, without keeping their contents in memory: the compat mode hashes
+    the files in hash_order_key order, so their contents are spilled to a temporary file and hashed by hexdigest().
+    Files that can't be hashed (a package.json that isn't JSON) are hashed by their path only, as by hash_package.
+    """
+
+    def __init__(self, mode: str = None):
+        self.mode = mode or HASH_MODE
+        if self.mode not in ('compat', 'merkle'):
+            raise ValueError(f"unknown hash mode: {self.mode}")
+        self.file_digests = {}  # {relative path: merkle digest}
+        self.spill = tempfile.TemporaryFile() if self.mode == 'compat' else None
+        self.spilled = []  # (relative path, offset, length) of the contents in the spill file
+
+    def add(self, relpath: str, data: bytes) -> None:
+        contents = _contents_for_hash(relpath, data)
+        self.file_digests[relpath] = _entry_digest(contents)
+        if self.spill is not None:
+            offset = self.spill.tell()
+            if contents:
+                self.spill.write(contents)
+            self.spilled.append((relpath, offset, len(contents) if contents else 0))
+
+    def hexdigest(self) -> str:
+        if self.mode == 'merkle':
+            return _directory_digests(self.file_digests)['']
+        m = hashlib.md5()
+        for relpath, offset, length in sorted(self.spilled, key=lambda entry: hash_order_key(entry[0])):
+            m.update(f"{relpath}\n".encode("utf-8"))
+            self.spill.seek(offset)
+            while length > 0:
+                chunk = self.spill.read(min(length, HASH_CHUNK_SIZE))
+                m.update(chunk)
+                length -= len(chunk)
+        return m.hexdigest()
+
+    def close(self) -> None:
+        if self.spill is not None:
+            self.spill.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def hash_entries(entries, mode: str = None) -> str:
+    """
+    Computes the hash of a package from its files ((relative path, contents) in any order), in the given mode.
+    """
+    with PackageHasher(mode) as hasher:
+        for relpath, data in entries:
+            hasher.add(relpath, data)
+        return hasher.hexdigest()
@@ -0,0 +1,134 @@
+import logging
+
+"""
+The persistence of the verdicts of packages in the Packages collection: one document per (name, version), enforced by a
+unique compound index that also serves every lookup, with idempotent upserts for the results of analyses.
+pymongo is imported by the methods that use it, so importing this module (and the app) doesn't load it.
+"""
+
+# The fields of a verdict document that the API returns
+VERDICT_PROJECTION = {'name': 1, 'version': 1, 'prediction': 1, 'features': 1, 'reproducible': 1, 'cloned': 1,
+                      'finalPrediction': 1, 'totalVotes': 1, 'agreedVotes': 1}
+# The fields that re-scoring needs
+FEATURES_PROJECTION = {'_id': 0, 'name': 1, 'version': 1, 'features': 1, 'prediction': 1}
+# The fields of a verdict that are written by an analysis (the votes are only written by votes)
+VERDICT_FIELDS = ['features', 'prediction', 'reproducible', 'cloned', 'finalPrediction']
+# The largest number of packages that are looked up with one query
+LOOKUP_BATCH_SIZE = 500
+# The name of the unique index of the Packages collection
+NAME_VERSION_INDEX = 'name_1_version_1'
+
+
+class PackageStore:
+    """
+    The verdict documents of the Packages collection.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.ensure_indexes()
+
+    def ensure_indexes(self) -> None:
+        """
+        Creates the unique (name, version) index if it doesn't exist. If the collection already has duplicates the
+        index can't be built: the error is logged and lookups work as before, without the uniqueness guarantee.
+        """
+        from pymongo import ASCENDING
+        from pymongo.errors import DuplicateKeyError, OperationFailure
+        try:
+            self.collection.create_index([('name', ASCENDING), ('version', ASCENDING)],
+                                         unique=True, name=NAME_VERSION_INDEX)
+        except (DuplicateKeyError, OperationFailure) as e:
+            logging.error(f"failed to create the unique index {NAME_VERSION_INDEX} of the Packages collection, "
+                          f"remove the duplicate packages first: {e}")
+
+    def find(self, name: str, version: str, projection: dict = VERDICT_PROJECTION):
+        """
+        Returns the verdict document of a package version, or None.
+        """
+        return self.collection.find_one({'name': name, 'version': version}, projection)
+
+    def find_many(self, packages, projection: dict = VERDICT_PROJECTION) -> dict:
+        """
+        Returns {(name, version): document} of the package versions that are in the collection.
+        """
+        packages = list(dict.fromkeys(packages))
+        found = {}
+        for start in range(0, len(packages), LOOKUP_BATCH_SIZE):
+            query = {'$or': [{'name': name, 'version': version}
+                             for name, version in packages[start:start + LOOKUP_BATCH_SIZE]]}
+            for document in self.collection.find(query, projection):
+                found[(document['name'], document['version'])] = document
+        return found
+
+    @staticmethod
+    def _verdict_update(verdict: dict) -> dict:
+        return {'$set': {field: verdict[field] for field in VERDICT_FIELDS if field in verdict},
+                '$setOnInsert': {'totalVotes': 0, 'agreedVotes': 0}}
+
+    def save_verdict(self, verdict: dict) -> dict:
+        """
+        Stores the verdict of an analysis (a dict with the name, the version and VERDICT_FIELDS) with an upsert, so
+        storing the same package twice (e.g. concurrent analyses of it) keeps one document and its votes.
+        Returns the stored document.
+        """
+        from pymongo import ReturnDocument
+        from pymongo.errors import DuplicateKeyError
+        key = {'name': verdict['name'], 'version': verdict['version']}
+        update = self._verdict_update(verdict)
+        try:
+            return self.collection.find_one_and_update(key, update, projection=VERDICT_PROJECTION, upsert=True,
+                                                       return_document=ReturnDocument.AFTER)
+        except DuplicateKeyError:
+            # a concurrent upsert inserted the document first, this one updates it
+            return self.collection.find_one_and_update(key, update, projection=VERDICT_PROJECTION,
+                                                       return_document=ReturnDocument.AFTER)
+
+    def save_verdicts(self, verdicts) -> int:
+        """
+        Stores many verdicts with one unordered bulk_write of upserts (for offline ingestion, see the ingest command).
+        Returns the number of inserted and modified documents.
+        """
+        from pymongo import UpdateOne
+        operations = [UpdateOne({'name': verdict['name'], 'version': verdict['version']},
+                                self._verdict_update(verdict), upsert=True) for verdict in verdicts]
+        if not operations:
+            return 0
+        result = self.collection.bulk_write(operations, ordered=False)
+        return result.upserted_count + result.modified_count
+
+    def apply_votes(self, increments: dict) -> dict:
+        """
+        Adds votes to packages atomically ($inc), with one unordered bulk_write:
+        increments is {(name, version): (total votes, agreed votes)}.
+        Returns the increments whose writes failed (the others were applied), so only they are retried.
+        """
+        from pymongo import UpdateOne
+        from pymongo.errors import BulkWriteError
+        keys = list(increments)
+        operations = [UpdateOne({'name': name, 'version': version},
+                                {'$inc': {'totalVotes': increments[(name, version)][0],
+                                          'agreedVotes': increments[(name, version)][1]}})
+                      for name, version in keys]
+        if not operations:
+            return {}
+        try:
+            self.collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            failed = [keys[error['index']] for error in e.details.get('writeErrors', [])]
+            logging.warning(f"failed to write the votes of {len(failed)} packages")
+            return {key: increments[key] for key in failed}
+        return {}
+
+    def iter_features(self, batch_size: int = 1000):
+        """
+        Yields the name, version, features and prediction of all the packages, in batches (lists of documents).
+        """
+        batch = []
+        for document in self.collection.find({}, FEATURES_PROJECTION, batch_size=batch_size):
+            batch.append(document)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
@@ -0,0 +1,373 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote
+
+import requests
+
+"""
+A client of the metadata of npm packages (their packuments: the documents of the registry with all the versions of a
+package), replacing `npm view` subprocesses. Packuments are cached on disk for a TTL and then revalidated with their
+ETag, and packages that the registry doesn't have are cached for a shorter TTL. The most recently used packuments are
+also kept parsed in memory, so a fresh packument isn't read from disk again. Versions are resolved as npm does: exact
+versions, dist-tags and semver ranges (to the highest version that satisfies the range).
+"""
+
+# The registry (or mirror, or a local stub) that the metadata and the tarballs of packages are downloaded from
+NPM_REGISTRY_URL = os.environ.get('SAFEDEP_NPM_REGISTRY', 'https://registry.npmjs.org')
+# The directory of the cached packuments (the cache is disabled when it's empty)
+PACKUMENT_CACHE_DIR = os.environ.get('SAFEDEP_PACKUMENT_CACHE', 'packument-cache')
+# How long a cached packument is used before it's revalidated with the registry (seconds)
+PACKUMENT_TTL = float(os.environ.get('SAFEDEP_PACKUMENT_TTL', 300))
+# How long a package that the registry doesn't have is cached as missing (seconds)
+PACKUMENT_NEGATIVE_TTL = float(os.environ.get('SAFEDEP_PACKUMENT_NEGATIVE_TTL', 60))
+# The size (bytes of JSON) of the parsed packuments that are kept in memory, packuments of popular packages are tens
+# of MB (their parsed objects take a few times more)
+PACKUMENT_MEMORY_BYTES = int(os.environ.get('SAFEDEP_PACKUMENT_MEMORY_BYTES', 64 * 1024 * 1024))
+
+
+class PackageNotFound(Exception):
+    """
+    The registry doesn't have the package (or the version of the package).
+    """
+
+
+class InvalidVersionRange(ValueError):
+    """
+    The version of a package is neither a version, a dist-tag nor a semver range.
+    """
+
+
+class RegistryClient:
+    """
+    Fetches and caches the packuments of packages.
+
+    Every cache entry is a JSON file {'fetched': time, 'etag': ETag, 'packument': packument or None}, where
+    a None packument means the registry answered 404. A fresh entry is used without a request; a stale entry with
+    an ETag is revalidated with If-None-Match, so an unchanged packument costs a 304 instead of its download.
+    The last entries that were read or written are also kept in memory (an LRU), up to memory_bytes bytes of JSON.
+    """
+
+    def __init__(self, registry: str = NPM_REGISTRY_URL, cache_dir: str = PACKUMENT_CACHE_DIR,
+                 ttl: float = PACKUMENT_TTL, negative_ttl: float = PACKUMENT_NEGATIVE_TTL, session=None,
+                 memory_bytes: int = PACKUMENT_MEMORY_BYTES):
+        self.registry = registry.rstrip('/')
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.session = session or requests.Session()
+        self.memory_bytes = memory_bytes
+        self.memory = OrderedDict()  # {name: (cache entry, size)}
+        self.memory_size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.memory_hits = 0
+        self.revalidations = 0
+        self.downloads = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def packument_url(self, name: str) -> str:
+        """
+        Returns the URL of the packument of a package (the '/' of a scoped name is escaped, as npm does).
+        """
+        return f"{self.registry}/{quote(name, safe='@')}"
+
+    def _cache_path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha1(name.encode('utf-8')).hexdigest() + '.json')
+
+    def _is_fresh(self, entry: dict, now: float) -> bool:
+        ttl = self.ttl if entry['packument'] is not None else self.negative_ttl
+        return now - entry['fetched'] < ttl
+
+    def _remember(self, name: str, entry: dict, size: int) -> None:
+        with self.lock:
+            previous = self.memory.pop(name, None)
+            if previous is not None:
+                self.memory_size -= previous[1]
+            if size > self.memory_bytes:
+                return
+            self.memory[name] = (entry, size)
+            self.memory_size += size
+            while self.memory_size > self.memory_bytes:
+                _, (_, evicted_size) = self.memory.popitem(last=False)
+                self.memory_size -= evicted_size
+
+    def _read_entry(self, name: str, now: float):
+        """
+        Returns the cache entry of a package and its size, or (None, 0).
+        """
+        with self.lock:
+            entry, size = self.memory.get(name, (None, 0))
+            if entry is not None and self._is_fresh(entry, now):
+                self.memory.move_to_end(name)
+                self.memory_hits += 1
+                return entry, size
+        # a stale entry in memory may have been refreshed on disk by another process
+        if not self.cache_dir:
+            return entry, size
+        try:
+            with open(self._cache_path(name), 'rb') as f:
+                data = f.read()
+            entry = json.loads(data)
+        except (OSError, ValueError):
+            return entry, size
+        self._remember(name, entry, len(data))
+        return entry, len(data)
+
+    def _write_entry(self, name: str, entry: dict, size: int) -> None:
+        self._remember(name, entry, size)
+        if not self.cache_dir:
+            return
+        path = self._cache_path(name)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"failed to cache the packument of {name}: {e}")
+
+    def packument(self, name: str) -> dict:
+        """
+        Returns the packument of a package.
+        Raises PackageNotFound if the registry doesn't have the package, and requests.HTTPError on other failures.
+        """
+        now = time.time()
+        entry, size = self._read_entry(name, now)
+        if entry is not None:
+            if self._is_fresh(entry, now):
+                with self.lock:
+                    self.hits += 1
+                if entry['packument'] is None:
+                    raise PackageNotFound(name)
+                return entry['packument']
+
+        headers = {'Accept': 'application/json'}
+        if entry is not None and entry.get('etag') and entry['packument'] is not None:
+            headers['If-None-Match'] = entry['etag']
+        response = self.session.get(self.packument_url(name), headers=headers, timeout=30)
+
+        if response.status_code == 304:
+            with self.lock:
+                self.revalidations += 1
+            entry = dict(entry, fetched=now)
+            self._write_entry(name, entry, size)
+            return entry['packument']
+        with self.lock:
+            self.downloads += 1
+        if response.status_code == 404:
+            self._write_entry(name, {'fetched': now, 'etag': None, 'packument': None}, 0)
+            raise PackageNotFound(name)
+        response.raise_for_status()
+        packument = response.json()
+        self._write_entry(name, {'fetched': now, 'etag': response.headers.get('ETag'), 'packument': packument},
+                          len(response.content))
+        return packument
+
+    def view(self, name: str, version: str) -> dict:
+        """
+        Returns the metadata of a package version, like `npm view <name>@<version> --json`: the manifest of the
+        version together with the 'dist-tags', 'versions' and 'time' of the package. The version can be a dist-tag or
+        a semver range, which resolves to the highest version that satisfies it (the 'version' of the result).
+        Raises PackageNotFound if the registry doesn't have the package or a version that matches, and
+        InvalidVersionRange if the version is not a version, a dist-tag or a range.
+        """
+        packument = self.packument(name)
+        versions = packument.get('versions', {})
+        resolved = packument.get('dist-tags', {}).get(version, version)
+        if resolved not in versions:
+            resolved = max_satisfying(versions, version)
+        if resolved is None:
+            raise PackageNotFound(f"{name}@{version}")
+        info = dict(versions[resolved])
+        info['dist-tags'] = packument.get('dist-tags', {})
+        info['versions'] = list(versions)
+        info['time'] = packument.get('time', {})
+        return info
+
+    def repository_url(self, name: str, version: str):
+        """
+        Returns the URL of the source repository of a package version, or None (see repository_url_of).
+        """
+        return repository_url_of(self.view(name, version))
+
+    def git_head(self, name: str, version: str):
+        """
+        Returns the commit that a package version was published from (its gitHead), or None.
+        """
+        return git_head_of(self.view(name, version))
+
+    def publish_time(self, name: str, version: str):
+        """
+        Returns the time that a package version was published (ISO 8601), or None.
+        """
+        return publish_time_of(self.view(name, version))
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the client.
+        """
+        with self.lock:
+            return {'hits': self.hits, 'memoryHits': self.memory_hits, 'revalidations': self.revalidations,
+                    'downloads': self.downloads, 'memoryBytes': self.memory_size}
+
+
+def repository_url_of(info: dict):
+    """
+    Returns the URL of the source repository in the metadata of a package version (see RegistryClient.view), from the
+    same properties that the reproducer looked up with npm view (repository.url, repository, homepage), or None.
+    """
+    repository = info.get('repository')
+    if isinstance(repository, dict) and repository.get('url'):
+        return repository['url']
+    if isinstance(repository, str) and repository:
+        return repository
+    return info.get('homepage') or None
+
+
+def git_head_of(info: dict):
+    """
+    Returns the gitHead in the metadata of a package version, or None.
+    """
+    return info.get('gitHead') or None
+
+
+def publish_time_of(info: dict):
+    """
+    Returns the publish time in the metadata of a package version, or None.
+    """
+    return info['time'].get(info.get('version'))
+
+
+_VERSION = re.compile(r'^\s*v?(\d+)\.(\d+)\.(\d+)(?:-([0-9A-Za-z.-]+))?(?:\+[0-9A-Za-z.-]+)?\s*$')
+_PARTIAL = re.compile(r'^v?(\d+|[xX*])(?:\.(\d+|[xX*]))?(?:\.(\d+|[xX*]))?(?:-([0-9A-Za-z.-]+))?(?:\+[0-9A-Za-z.-]+)?$')
+_COMPARATOR = re.compile(r'^(<=|>=|<|>|=|\^|~>|~)?\s*(\S+)$')
+
+
+def _version_key(major: int, minor: int, patch: int, prerelease=None) -> tuple:
+    # a version with a prerelease precedes the version without it, numeric identifiers precede the others
+    if not prerelease:
+        return major, minor, patch, 1, ()
+    identifiers = tuple((0, int(part), '') if part.isdigit() else (1, 0, part) for part in prerelease.split('.'))
+    return major, minor, patch, 0, identifiers
+
+
+def version_key(version: str):
+    """
+    Returns the key that orders versions by their semver precedence, or None if the version isn't a semver version.
+    """
+    match = _VERSION.match(version)
+    if match is None:
+        return None
+    major, minor, patch, prerelease = match.groups()
+    return _version_key(int(major), int(minor), int(patch), prerelease)
+
+
+def _desugar(operator: str, partial: str) -> list:
+    """
+    Returns the (operator, version key, has prerelease) comparators of one comparator of a range, with the partial
+    versions (1, 1.2, 1.x) and the ^ and ~ ranges expanded as npm does.
+    """
+    match = _PARTIAL.match(partial)
+    if match is None:
+        raise InvalidVersionRange(partial)
+    parts = [None if part is None or part in 'xX*' else int(part) for part in match.groups()[:3]]
+    prerelease = match.group(4)
+    # a wildcard can only be followed by wildcards
+    if any(parts[i] is None and parts[i + 1] is not None for i in range(2)):
+        raise InvalidVersionRange(partial)
+    major, minor, patch = parts
+    if major is None:
+        return [] if operator in ('', '=', '>=', '<=', '^', '~', '~>') else [('<', _version_key(0, 0, 0, '0'), False)]
+    floor = _version_key(major, minor or 0, patch or 0, prerelease)
+    explicit = prerelease is not None
+    if minor is None:
+        next_version = _version_key(major + 1, 0, 0, '0')
+    elif patch is None:
+        next_version = _version_key(major, minor + 1, 0, '0')
+    else:
+        next_version = None
+
+    if operator == '^':
+        if major > 0 or minor is None:
+            ceiling = _version_key(major + 1, 0, 0, '0')
+        elif minor > 0 or patch is None:
+            ceiling = _version_key(0, minor + 1, 0, '0')
+        else:
+            ceiling = _version_key(0, 0, patch + 1, '0')
+        return [('>=', floor, explicit), ('<', ceiling, False)]
+    if operator in ('~', '~>'):
+        ceiling = _version_key(major + 1, 0, 0, '0') if minor is None else _version_key(major, minor + 1, 0, '0')
+        return [('>=', floor, explicit), ('<', ceiling, False)]
+    if next_version is None:
+        return [(operator or '=', floor, explicit)]
+    # partial versions
+    if operator in ('', '='):
+        return [('>=', floor, False), ('<', next_version, False)]
+    if operator == '>':
+        return [('>=', next_version, False)]
+    if operator == '<=':
+        return [('<', next_version, False)]
+    return [(operator, floor, False)]
+
+
+def parse_range(version_range: str) -> list:
+    """
+    Parses a semver range (as npm does: ||, hyphen ranges, comparators, ^, ~ and x-ranges) into its comparator sets,
+    lists of (operator, version key, has prerelease). Raises InvalidVersionRange if it isn't a range.
+    """
+    if not isinstance(version_range, str):
+        raise InvalidVersionRange(version_range)
+    comparator_sets = []
+    for alternative in version_range.split('||'):
+        comparators = []
+        hyphen = re.match(r'^\s*(\S+)\s+-\s+(\S+)\s*$', alternative)
+        if hyphen is not None:
+            comparators.extend(_desugar('>=', hyphen.group(1)))
+            comparators.extend(_desugar('<=', hyphen.group(2)))
+        else:
+            # an operator may be separated from its version by spaces (>= 1.2.3)
+            tokens = re.sub(r'(<=|>=|<|>|=|\^|~>|~)\s+', r'\1', alternative.strip()).split()
+            for token in tokens:
+                match = _COMPARATOR.match(token)
+                if match is None:
+                    raise InvalidVersionRange(version_range)
+                comparators.extend(_desugar(match.group(1) or '', match.group(2)))
+        comparator_sets.append(comparators)
+    return comparator_sets
+
+
+_COMPARE = {'=': lambda a, b: a == b, '<': lambda a, b: a < b, '<=': lambda a, b: a <= b,
+            '>': lambda a, b: a > b, '>=': lambda a, b: a >= b}
+
+
+def _satisfies(key: tuple, comparators: list) -> bool:
+    if not all(_COMPARE[operator](key, bound) for operator, bound, _ in comparators):
+        return False
+    # a prerelease satisfies a range only if the range names a prerelease of the same major.minor.patch
+    return key[3] == 1 or any(explicit and bound[:3] == key[:3] for _, bound, explicit in comparators)
+
+
+def max_satisfying(versions, version_range: str):
+    """
+    Returns the highest of the versions that satisfies a semver range, or None if none does.
+    Raises InvalidVersionRange if the range isn't a range.
+    """
+    try:
+        comparator_sets = parse_range(version_range)
+    except InvalidVersionRange:
+        raise InvalidVersionRange(f"invalid version or range: {version_range}") from None
+    best, best_key = None, None
+    for version in versions:
+        key = version_key(version)
+        if key is None or (best_key is not None and key <= best_key):
+            continue
+        if any(_satisfies(key, comparators) for comparators in comparator_sets):
+            best, best_key = version, key
+    return best
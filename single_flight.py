@@ -0,0 +1,203 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+"""
+Single-flight de-duplication of analyses: concurrent requests for the same package version share one analysis.
+In a process, the first caller runs it and the others wait for its result (SingleFlight); across the workers that
+share a MongoDB, the worker that holds the lease of the package version runs it and the others wait until its verdict
+is stored (AnalysisLeases).
+"""
+
+# How long (seconds) a lease is valid without being renewed; the worker that holds it renews it every third of that,
+# so the lease of a worker that died expires (and is taken over) after at most this long
+LEASE_TTL = float(os.environ.get('SAFEDEP_ANALYSIS_LEASE_TTL', 60))
+# How often (seconds) a worker that waits for the analysis of another worker checks for its verdict
+LEASE_POLL_INTERVAL = float(os.environ.get('SAFEDEP_ANALYSIS_LEASE_POLL_INTERVAL', 1.0))
+# The longest time (seconds) a worker waits for the analysis of another worker
+LEASE_WAIT_TIMEOUT = float(os.environ.get('SAFEDEP_ANALYSIS_LEASE_WAIT_TIMEOUT', 900))
+# The name of the TTL index that removes the expired leases
+LEASE_EXPIRY_INDEX = 'expiresAt_1'
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs fn once per key at a time: do(key, fn) of a key that is already running waits for the running call and
+    returns its result (or raises its exception) instead of calling fn again. Results are not cached - the next call
+    after the running one finished calls fn again.
+    """
+
+    def __init__(self):
+        self.calls = {}  # {key: _Call} of the running calls
+        self.lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+                self.executed += 1
+            call.done.set()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'running': len(self.calls), 'executed': self.executed, 'coalesced': self.coalesced}
+
+
+class Lease:
+    """
+    A lease held by this worker, renewed in the background until it's released.
+    """
+
+    def __init__(self, leases, key: str, token: str):
+        self.leases = leases
+        self.key = key
+        self.token = token
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._renew, name=f'lease {key}', daemon=True)
+        self.thread.start()
+
+    def _renew(self) -> None:
+        while not self.stopped.wait(self.leases.ttl / 3):
+            try:
+                if not self.leases.renew(self.key, self.token):
+                    logging.warning(f"the lease of the analysis of {self.key} was taken over by another worker")
+                    return
+            except Exception:
+                logging.exception(f"failed to renew the lease of the analysis of {self.key}")
+
+    def release(self) -> None:
+        self.stopped.set()
+        try:
+            self.leases.collection.delete_one({'_id': self.key, 'token': self.token})
+        except Exception:
+            # the lease expires by itself
+            logging.exception(f"failed to release the lease of the analysis of {self.key}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class AnalysisLeases:
+    """
+    The leases of the analyses in progress, one document {_id: key, owner, token, expiresAt} per package version in
+    a MongoDB collection that all the workers share. The unique _id makes sure one worker at a time holds a lease;
+    an expired lease (of a worker that died) is taken over, and removed by a TTL index if nobody takes it over.
+    """
+
+    def __init__(self, collection, ttl: float = LEASE_TTL, poll_interval: float = LEASE_POLL_INTERVAL,
+                 wait_timeout: float = LEASE_WAIT_TIMEOUT):
+        self.collection = collection
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.wait_timeout = wait_timeout
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self.acquired = 0
+        self.waited = 0
+        self.ensure_indexes()
+
+    def ensure_indexes(self) -> None:
+        from pymongo import ASCENDING
+        from pymongo.errors import OperationFailure
+        try:
+            self.collection.create_index([('expiresAt', ASCENDING)], expireAfterSeconds=0, name=LEASE_EXPIRY_INDEX)
+        except OperationFailure as e:
+            logging.error(f"failed to create the TTL index {LEASE_EXPIRY_INDEX} of the leases of analyses: {e}")
+
+    def _expiry(self) -> datetime:
+        return datetime.now(timezone.utc) + timedelta(seconds=self.ttl)
+
+    def acquire(self, key: str):
+        """
+        Returns the Lease of the key if this worker got it, or None if another worker holds it.
+        """
+        from pymongo.errors import DuplicateKeyError
+        token = uuid.uuid4().hex
+        document = {'owner': self.owner, 'token': token, 'expiresAt': self._expiry()}
+        try:
+            self.collection.insert_one(dict(document, _id=key))
+        except DuplicateKeyError:
+            # take over the lease if it expired
+            taken = self.collection.find_one_and_update(
+                {'_id': key, 'expiresAt': {'$lte': datetime.now(timezone.utc)}}, {'$set': document})
+            if taken is None:
+                return None
+            logging.warning(f"took over the expired lease of the analysis of {key} from {taken.get('owner')}")
+        self.acquired += 1
+        return Lease(self, key, token)
+
+    def renew(self, key: str, token: str) -> bool:
+        """
+        Extends a lease that this worker holds. Returns False if it doesn't hold it anymore.
+        """
+        result = self.collection.update_one({'_id': key, 'token': token}, {'$set': {'expiresAt': self._expiry()}})
+        return result.matched_count == 1
+
+    def acquire_or_wait(self, key: str, lookup):
+        """
+        Returns (lease, None) when this worker is to run the analysis of the key, or (None, result) when another
+        worker ran it: while another worker holds the lease, lookup() (the stored result, or None) is polled until it
+        returns a result, or until the lease is released or expired without one, and then this worker acquires it.
+        Raises TimeoutError after wait_timeout seconds.
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        waited = False
+        while True:
+            lease = self.acquire(key)
+            if lease is not None:
+                # a previous holder may have stored the result and released the lease since the caller looked it up
+                try:
+                    result = lookup()
+                except BaseException:
+                    lease.release()
+                    raise
+                if result is not None:
+                    lease.release()
+                    return None, result
+                return lease, None
+            if not waited:
+                waited = True
+                self.waited += 1
+                logging.info(f"waiting for the analysis of {key} by another worker")
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"the analysis of {key} by another worker didn't finish in {self.wait_timeout}s")
+            time.sleep(self.poll_interval)
+            result = lookup()
+            if result is not None:
+                return None, result
+
+    def stats(self) -> dict:
+        return {'acquired': self.acquired, 'waited': self.waited}
@@ -0,0 +1,162 @@
+import io
+import json
+import logging
+import os
+import tarfile
+
+import requests
+
+from features_cache import content_hash, detector_version
+from features_utils import CODE_FEATURES_KEYWORDS, GEOLOCATION_KEYWORDS, ByteStatisticsBatch, PackageStats, compile_substrings, parse_code, search_code_features
+from package_hash import PackageHasher
+from registry_metadata import NPM_REGISTRY_URL
+
+"""
+Analysis of a package from its tarball (the published contents of the package), without npm install:
+the members of the tarball are streamed through the feature extractors and the package hash without
+extracting them to disk, one member in memory at a time.
+"""
+
+# The largest tarball that is downloaded or accepted (bytes)
+MAX_TARBALL_SIZE = int(os.environ.get('SAFEDEP_MAX_TARBALL_SIZE', 200 * 1024 * 1024))
+# The largest member of a tarball (bytes, decompressed)
+MAX_TARBALL_FILE_SIZE = int(os.environ.get('SAFEDEP_MAX_TARBALL_FILE_SIZE', 64 * 1024 * 1024))
+# The largest total size of the members of a tarball (bytes, decompressed), against gzip and tar bombs
+MAX_TARBALL_UNPACKED_SIZE = int(os.environ.get('SAFEDEP_MAX_TARBALL_UNPACKED_SIZE', 1024 * 1024 * 1024))
+
+
+class TarballAnalysis:
+    """
+    The result of the analysis of a tarball.
+
+    features: the 14 features of the package, in the order of the model
+        (PII, file_sys_access, ..., package_installation, geolocation, minified_code, no_content,
+        longest_line, num_of_files, has_license).
+    hash: the hash of the package, the same as hash_package of the extracted package.
+    name, version: from the package.json of the package (None if it has none).
+    file_digests: {relative path: digest} of the files of the package, for the near-duplicate clone index.
+    """
+
+    def __init__(self, features, hash, name, version, file_digests):
+        self.features = features
+        self.hash = hash
+        self.name = name
+        self.version = version
+        self.file_digests = file_digests
+
+
+def tarball_url(name: str, version: str, registry: str = NPM_REGISTRY_URL) -> str:
+    """
+    Returns the URL of the tarball of a package version in the registry,
+    e.g. https://registry.npmjs.org/@scope/name/-/name-1.0.0.tgz
+    """
+    basename = name.split('/')[-1]
+    return f"{registry.rstrip('/')}/{name}/-/{basename}-{version}.tgz"
+
+
+def fetch_tarball(name: str, version: str, registry: str = NPM_REGISTRY_URL, session=None) -> bytes:
+    """
+    Downloads the tarball of a package version from the registry.
+    Raises requests.HTTPError if the registry doesn't have it, and ValueError if it's larger than MAX_TARBALL_SIZE.
+    """
+    url = tarball_url(name, version, registry)
+    logging.info(f"downloading {url}")
+    response = (session or requests).get(url, stream=True, timeout=60)
+    response.raise_for_status()
+    data = io.BytesIO()
+    for chunk in response.iter_content(chunk_size=1024 * 1024):
+        data.write(chunk)
+        if data.tell() > MAX_TARBALL_SIZE:
+            raise ValueError(f"the tarball of {name}@{version} is larger than {MAX_TARBALL_SIZE} bytes")
+    return data.getvalue()
+
+
+def iter_tarball_files(fileobj, max_file_size: int = MAX_TARBALL_FILE_SIZE,
+                       max_unpacked_size: int = MAX_TARBALL_UNPACKED_SIZE):
+    """
+    Streams the regular files of a package tarball: yields (relative path, contents) for every file, where the
+    path is relative to the root of the package (npm packs the package under a 'package/' directory).
+    Raises ValueError (before reading it) at a member larger than max_file_size, or when the members add up to
+    more than max_unpacked_size bytes.
+    """
+    unpacked_size = 0
+    with tarfile.open(fileobj=fileobj, mode='r|*') as tar:
+        for member in tar:
+            unpacked_size += member.size
+            if unpacked_size > max_unpacked_size:
+                raise ValueError(f"the tarball unpacks to more than {max_unpacked_size} bytes")
+            if not member.isfile():
+                continue
+            if member.size > max_file_size:
+                raise ValueError(f"{member.name} in the tarball is larger than {max_file_size} bytes")
+            parts = [part for part in member.name.split('/') if part not in ('', '.')]
+            if len(parts) < 2 or '..' in parts:
+                continue
+            relpath = '/'.join(parts[1:])
+            yield relpath, tar.extractfile(member).read()
+
+
+def analyse_tarball(fileobj, cache=None, keywords_lists=CODE_FEATURES_KEYWORDS) -> TarballAnalysis:
+    """
+    Extracts the features and the hash of a package from its tarball in a single pass over its members.
+
+    The code features are searched in the same files as extract_feature: the '.js'/'.json' files (but not
+    '.min.js') of the root of the package and of its direct sub directories. The directory features are computed
+    over all the files of the package.
+
+    Parameters:
+        fileobj: A file object of the tarball (.tgz or .tar).
+        cache (FeatureCache, optional): The cache of the features of files by their contents.
+        keywords_lists (list of lists): The keyword lists of the code features.
+
+    Returns:
+        TarballAnalysis: The features, the hash, the name and the version of the package.
+    """
+    logging.info("start func: analyse_tarball")
+    detectors = detector_version(keywords_lists)
+    geolocation_pattern = compile_substrings(GEOLOCATION_KEYWORDS)
+    code_features = [0] * len(keywords_lists)
+    stats = PackageStats()
+    batch = ByteStatisticsBatch(cache) if cache is not None else None
+    package_json = None
+
+    with PackageHasher() as hasher:
+        # every member is hashed as it's read, only the digests are kept
+        for relpath, data in iter_tarball_files(fileobj):
+            filename = relpath.rsplit('/', 1)[-1]
+            stats.add_data(filename, data, geolocation_pattern, batch)
+            hasher.add(relpath, data)
+            if relpath == 'package.json':
+                package_json = data
+
+            depth = relpath.count('/')
+            if depth > 1 or (not filename.endswith('.js') and not filename.endswith('.json')) or filename.endswith('.min.js'):
+                continue
+            file_features = None
+            if cache is not None:
+                file_hash = content_hash(data)
+                file_features = cache.get_code_features([file_hash], detectors).get(file_hash)
+            if file_features is None:
+                file_features = search_code_features(parse_code(data), keywords_lists)
+                if cache is not None:
+                    cache.put_code_features({file_hash: file_features}, detectors)
+            code_features = [max(a, b) for a, b in zip(code_features, file_features)]
+
+        package_hash = hasher.hexdigest()
+        file_digests = hasher.file_digests
+    if batch is not None:
+        batch.flush()
+
+    name = package_version = None
+    if package_json is not None:
+        try:
+            pkg = json.loads(package_json)
+            name, package_version = pkg.get('name'), pkg.get('version')
+        except ValueError:
+            logging.warning("the package.json of the tarball isn't valid JSON")
+
+    directory_features = stats.features()
+    features = code_features + [directory_features['geolocation'], directory_features['minified_code'],
+                                directory_features['no_content'], directory_features['longest_line'],
+                                directory_features['num_of_files'], directory_features['has_license']]
+    return TarballAnalysis(features, package_hash, name, package_version, file_digests)
@@ -0,0 +1,50 @@
+import os
+import sys
+import unittest
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from compiled_model import PARITY_DATASETS, check_parity, load_compiled_model, read_dataset
+
+"""
+Checks that the exported model (utils/predictor/model.npz) predicts the bundled datasets exactly like the pickled
+scikit-learn model (utils/predictor/model.pkl). Skipped when scikit-learn isn't installed or the pickle can't be
+loaded with the installed version.
+"""
+
+MODEL_PATH = os.path.join(ROOT, 'utils', 'predictor', 'model.pkl')
+COMPILED_MODEL_PATH = os.path.join(ROOT, 'utils', 'predictor', 'model.npz')
+
+
+def load_pickled_model():
+    try:
+        import joblib
+        with warnings.catch_warnings():
+            # the pickle may come from another (compatible) version of scikit-learn
+            warnings.simplefilter('ignore')
+            with open(MODEL_PATH, 'rb') as f:
+                return joblib.load(f)
+    except Exception as e:
+        raise unittest.SkipTest(f"can't load {MODEL_PATH}: {e}")
+
+
+class CompiledModelParityTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.model = load_pickled_model()
+        cls.compiled = load_compiled_model(COMPILED_MODEL_PATH)
+
+    def test_no_mismatches_on_the_datasets(self):
+        for dataset in PARITY_DATASETS:
+            with self.subTest(dataset=dataset):
+                X = read_dataset(os.path.join(ROOT, dataset))
+                with warnings.catch_warnings():
+                    warnings.filterwarnings('ignore', message='X does not have valid feature names')
+                    self.assertEqual(check_parity(self.model, self.compiled, X), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -76,7 +76,7 @@ echo '{
   }
 }' > package.json
 
-git rev-parse HEAD
+git rev-parse HEAD || echo "The working directory is not a git repository."
 
 # find directory containing package.json file with the same name as the package
 # we sort the paths so that shallower ones are preferred over deeper ones
@@ -94,7 +94,12 @@ fi
 
 # attempt to set the time to the time of publication
 now=$(date)
-(npm view "$pkgName" time --json | jq ".[\"$version\"]" | xargs sudo -n date -s) || \
+if [ -n "${SAFEDEP_PUBLISH_TIME:-}" ]; then
+  publishTime="\"$SAFEDEP_PUBLISH_TIME\""
+else
+  publishTime=$(npm view "$pkgName" time --json | jq ".[\"$version\"]")
+fi
+(echo "$publishTime" | xargs sudo -n date -s) || \
   (echo "Failed to set date; continuing.")
 
 # run a few possible build scripts under a 10-minute timeout
@@ -36,13 +36,16 @@ version="${spec##*@}"
 
 echo "Trying to reproduce package $package at version $version."
 
-# Clone repo
-for prop in repository.url repository homepage; do
-  repoUrl=$(npm view "$spec" "$prop")
-  if ! [ -z "$repoUrl" ]; then
-    break
-  fi
-done
+# Clone repo (the server passes the metadata of the package in the environment, otherwise it's looked up with npm view)
+repoUrl="${SAFEDEP_REPOSITORY_URL:-}"
+if [ -z "$repoUrl" ]; then
+  for prop in repository.url repository homepage; do
+    repoUrl=$(npm view "$spec" "$prop")
+    if ! [ -z "$repoUrl" ]; then
+      break
+    fi
+  done
+fi
 if [ -z "$repoUrl" ]; then
   echo "Could not find git repository for $spec."
   exit 1
@@ -57,7 +60,7 @@ git clone $repoUrl "$package_dir"
 # Check out right commit
 cd "$package_dir"
 # cd working
-ref=$(npm view "$spec" gitHead)
+ref="${SAFEDEP_GIT_HEAD:-$(npm view "$spec" gitHead)}"
 if [ -z "$ref" ]; then
   # typical branch names for $version
   candidate_refs="$version v$version v-$version"
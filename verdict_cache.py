@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import OrderedDict
+
+"""
+An in-process cache of the verdict documents of packages (the documents of the Packages collection),
+so hot lookups of popular packages are served without a MongoDB round-trip.
+"""
+
+# A cached "not in the database" result
+_MISSING = object()
+
+
+class VerdictCache:
+    """
+    A bounded LRU cache of verdict documents by (name, version), where every entry expires after a TTL.
+    Lookups of packages that are not in the database are cached too (negative caching), for a shorter TTL,
+    so a package that is being analysed doesn't stay "missing" for long after its verdict is inserted.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 300, negative_ttl: float = 30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict()  # {(name, version): (expiry time, document or _MISSING)}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def get(self, name: str, version: str):
+        """
+        Returns (found, document): found is False if the package isn't cached (or expired), otherwise the document
+        is the cached verdict document, or None if the package is cached as not in the database.
+        """
+        key = (name, version)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            if entry[1] is _MISSING:
+                self.negative_hits += 1
+                return True, None
+            self.hits += 1
+            return True, dict(entry[1])
+
+    def put(self, name: str, version: str, document) -> None:
+        """
+        Caches the verdict document of a package, or None if the package is not in the database.
+        """
+        ttl = self.ttl if document is not None else self.negative_ttl
+        value = dict(document) if document is not None else _MISSING
+        with self.lock:
+            self.entries[(name, version)] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end((name, version))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def update(self, name: str, version: str, fields: dict) -> None:
+        """
+        Updates fields of a cached verdict document (write-through of an update of the database).
+        """
+        with self.lock:
+            entry = self.entries.get((name, version))
+            if entry is not None and entry[1] is not _MISSING:
+                entry[1].update(fields)
+
+    def increment(self, name: str, version: str, increments: dict):
+        """
+        Adds to numeric fields of a cached verdict document (write-through of an $inc of the database).
+        Returns a copy of the updated document, or None if the package isn't cached.
+        """
+        with self.lock:
+            entry = self.entries.get((name, version))
+            if entry is None or entry[1] is _MISSING:
+                return None
+            for field, value in increments.items():
+                entry[1][field] = entry[1].get(field, 0) + value
+            return dict(entry[1])
+
+    def invalidate(self, name: str, version: str) -> None:
+        with self.lock:
+            self.entries.pop((name, version), None)
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the cache.
+        """
+        with self.lock:
+            return {'entries': len(self.entries), 'hits': self.hits, 'negativeHits': self.negative_hits,
+                    'misses': self.misses}
@@ -0,0 +1,94 @@
+import logging
+import threading
+
+"""
+Write-behind buffering of votes: the votes of packages are counted in memory and written to the database as
+coalesced increments, one bulk write per flush interval instead of one write per vote.
+"""
+
+
+class VoteBuffer:
+    """
+    Buffers vote increments by (name, version) and flushes them with flush_fn({(name, version): (total, agreed)}),
+    which returns the increments that it failed to write (or None).
+
+    A background thread flushes every `interval` seconds, so a vote reaches the database at most about `interval`
+    seconds (plus the time of the write) after it was cast; a buffer of max_pending packages is flushed at once.
+    If a flush fails its increments are put back and retried with the next one. close() flushes what's left.
+    An interval of 0 writes every vote through immediately.
+    """
+
+    def __init__(self, flush_fn, interval: float = 1.0, max_pending: int = 1000):
+        self.flush_fn = flush_fn
+        self.interval = interval
+        self.max_pending = max_pending
+        self.pending = {}  # {(name, version): [total votes, agreed votes]}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.flushed_votes = 0
+        self.flushes = 0
+        self.thread = None
+        if interval > 0:
+            self.thread = threading.Thread(target=self._run, name='vote-flush', daemon=True)
+            self.thread.start()
+
+    def add(self, name: str, version: str, agreed: bool) -> None:
+        """
+        Counts a vote of a package.
+        """
+        with self.lock:
+            counts = self.pending.setdefault((name, version), [0, 0])
+            counts[0] += 1
+            counts[1] += 1 if agreed else 0
+            full = len(self.pending) >= self.max_pending
+        if self.thread is None or self.closed:
+            self.flush()
+        elif full:
+            self.wakeup.set()
+
+    def _run(self) -> None:
+        while not self.closed:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Writes the buffered increments. Returns the number of packages that were written.
+        """
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+            if not pending:
+                return 0
+            try:
+                failed = self.flush_fn({key: tuple(counts) for key, counts in pending.items()}) or {}
+            except Exception:
+                logging.exception(f"failed to flush the votes of {len(pending)} packages, retrying with the next flush")
+                failed = pending
+            if failed:
+                with self.lock:
+                    for key, (total, agreed) in failed.items():
+                        counts = self.pending.setdefault(key, [0, 0])
+                        counts[0] += total
+                        counts[1] += agreed
+            self.flushes += 1
+            self.flushed_votes += sum(total for key, (total, agreed) in pending.items() if key not in failed)
+            return len(pending) - len(failed)
+
+    def close(self) -> None:
+        """
+        Stops the flush thread and flushes the remaining votes (on shutdown).
+        """
+        self.closed = True
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout=max(1.0, 2 * self.interval))
+        self.flush()
+
+    def stats(self) -> dict:
+        with self.lock:
+            pending = sum(total for total, agreed in self.pending.values())
+        return {'pendingVotes': pending, 'flushedVotes': self.flushed_votes, 'flushes': self.flushes}
@@ -0,0 +1,52 @@
+import logging
+import os
+import shutil
+import tempfile
+
+"""
+Isolated workspaces of analyses: every analysis installs, extracts, hashes and reproduces its package in its own
+temporary directory instead of the server's directory and its shared ./node_modules, so analyses can run at the
+same time without overwriting each other.
+"""
+
+# The directory the workspaces are created in (default: the temporary directory of the system)
+WORKSPACES_ROOT = os.environ.get('SAFEDEP_WORKSPACES_ROOT') or None
+# Keep the workspaces after the analyses, for debugging
+KEEP_WORKSPACES = os.environ.get('SAFEDEP_KEEP_WORKSPACES', '') == '1'
+
+
+class Workspace:
+    """
+    The temporary directory of one analysis.
+
+    root: the working directory of the install (its package.json is written there) and of the reproducer.
+    node_modules: the directory the package and its dependencies are installed in.
+    """
+
+    def __init__(self, name: str, version: str):
+        # '/' in scoped package names isn't allowed in the prefix of a directory
+        prefix = 'safedep-' + f'{name}@{version}'.replace('/', '+') + '-'
+        self.root = tempfile.mkdtemp(prefix=prefix, dir=WORKSPACES_ROOT)
+        self.node_modules = os.path.join(self.root, 'node_modules')
+        logging.info(f"workspace of {name}@{version}: {self.root}")
+
+    def package_dir(self, name: str) -> str:
+        """
+        Returns the directory a package is installed in.
+        """
+        return os.path.join(self.node_modules, *name.split('/'))
+
+    def cleanup(self) -> None:
+        """
+        Deletes the workspace (unless KEEP_WORKSPACES is set).
+        """
+        if KEEP_WORKSPACES:
+            logging.info(f"keeping workspace {self.root}")
+            return
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def __enter__(self) -> 'Workspace':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.cleanup()